@@ -115,22 +115,20 @@ def dynamic_mix_data_prep_aishell1mix(hparams):
         )
 
         if hparams["use_wham_noise"]:
-            noise_file = np.random.choice(noise_files, 1, replace=False)
+            noise_file = noise_files[np.random.randint(len(noise_files))]
 
-            noise, fs_read = torchaudio.load(noise_file[0])
+            noise, fs_read = torchaudio.load(noise_file)
             noise = noise.squeeze()
 
         # select two speakers randomly
         sources = []
         spk_files = [
-            np.random.choice(spk_hashtable[spk], 1, False)[0]
+            spk_hashtable[spk][np.random.randint(len(spk_hashtable[spk]))]
             for spk in speakers
         ]
 
-        minlen = min(
-            *[torchaudio.info(x).num_frames for x in spk_files],
-            hparams["training_signal_len"],
-        )
+        lengths = [torchaudio.info(x).num_frames for x in spk_files]
+        minlen = min(*lengths, hparams["training_signal_len"])
 
         meter = pyloudnorm.Meter(hparams["sample_rate"])
 
@@ -161,9 +159,8 @@ def dynamic_mix_data_prep_aishell1mix(hparams):
 
             return torch.from_numpy(signal)
 
-        for i, spk_file in enumerate(spk_files):
+        for i, (spk_file, length) in enumerate(zip(spk_files, lengths)):
             # select random offset
-            length = torchaudio.info(spk_file).num_frames
             start = 0
             stop = length
             if length > minlen:  # take a random window
@@ -195,8 +192,10 @@ def dynamic_mix_data_prep_aishell1mix(hparams):
         else:
             weight = 1
 
-        sources = weight * sources
-        mixture = weight * mixture
+        # sources and mixture are fresh tensors, so rescale them in place
+        if weight != 1:
+            sources.mul_(weight)
+            mixture.mul_(weight)
 
         yield mixture
         for i in range(hparams["num_spks"]):
@@ -207,7 +206,8 @@ def dynamic_mix_data_prep_aishell1mix(hparams):
             yield None
 
         if hparams["use_wham_noise"]:
-            noise = noise * weight
+            if weight != 1:
+                noise.mul_(weight)
             yield noise
         else:
             yield None
@@ -222,6 +222,7 @@ def dynamic_mix_data_prep_aishell1mix(hparams):
         train_data,
         batch_size=hparams["dataloader_opts"]["batch_size"],
         num_workers=hparams["dataloader_opts"]["num_workers"],
+        persistent_workers=hparams["dataloader_opts"]["num_workers"] > 0,
         collate_fn=PaddedBatch,
         worker_init_fn=lambda x: np.random.seed(
             int.from_bytes(os.urandom(4), "little") + x
@@ -47,6 +47,24 @@ def dynamic_mix_data_prep(hparams):
     if "noise" in hparams["experiment_name"]:
         noise_files = get_wham_noise_filenames(hparams)
 
+    if "reverb" not in hparams["experiment_name"]:
+        subject_path_list = glob.glob(
+            os.path.join(hparams["hrtf_wav_path"], "subject*")
+        )
+
+    # every source is convolved with its own randomly chosen HRTF, so the
+    # convolutions cannot be batched, but the resampling kernels (one per
+    # pair of sample rates) can be built once rather than for every HRTF
+    resamplers = {}
+
+    def resample_hrtf(hrtf, orig_freq, new_freq):
+        """Resamples an HRTF to the sample rate of the sources."""
+        if (orig_freq, new_freq) not in resamplers:
+            resamplers[(orig_freq, new_freq)] = torchaudio.transforms.Resample(
+                orig_freq, new_freq
+            )
+        return resamplers[(orig_freq, new_freq)](hrtf)
+
     @sb.utils.data_pipeline.takes("mix_wav")
     @sb.utils.data_pipeline.provides(
         "mix_sig", "s1_sig", "s2_sig", "s3_sig", "noise_sig"
@@ -63,9 +81,9 @@ def dynamic_mix_data_prep(hparams):
         )
 
         if "noise" in hparams["experiment_name"]:
-            noise_file = np.random.choice(noise_files, 1, replace=False)
+            noise_file = noise_files[np.random.randint(len(noise_files))]
 
-            noise, fs_read = torchaudio.load(noise_file[0])
+            noise, fs_read = torchaudio.load(noise_file)
             noise = noise.squeeze()
 
         # select two speakers randomly
@@ -73,18 +91,15 @@ def dynamic_mix_data_prep(hparams):
         first_lvl = None
 
         spk_files = [
-            np.random.choice(spk_hashtable[spk], 1, False)[0]
+            spk_hashtable[spk][np.random.randint(len(spk_hashtable[spk]))]
             for spk in speakers
         ]
 
-        minlen = min(
-            *[torchaudio.info(x).num_frames for x in spk_files],
-            hparams["training_signal_len"],
-        )
+        lengths = [torchaudio.info(x).num_frames for x in spk_files]
+        minlen = min(*lengths, hparams["training_signal_len"])
 
-        for i, spk_file in enumerate(spk_files):
+        for i, (spk_file, length) in enumerate(zip(spk_files, lengths)):
             # select random offset
-            length = torchaudio.info(spk_file).num_frames
             start = 0
             stop = length
             if length > minlen:  # take a random window
@@ -122,16 +137,12 @@ def dynamic_mix_data_prep(hparams):
                     "CATT_{}_{}.wav".format(reverb_time, azimuth),
                 )
                 hrtf, sr = torchaudio.load(hrtf_file)
-                transform = torchaudio.transforms.Resample(sr, fs_read)
-                hrtf = transform(hrtf)
+                hrtf = resample_hrtf(hrtf, sr, fs_read)
                 tmp_bi = torch.from_numpy(
                     fftconvolve(tmp.numpy(), hrtf.numpy(), mode="same")
                 )
             else:
                 tmp_bi = torch.FloatTensor(len(tmp), 2)  # binaural
-                subject_path_list = glob.glob(
-                    os.path.join(hparams["hrtf_wav_path"], "subject*")
-                )
                 subject_path = np.random.choice(subject_path_list)
                 azimuth_list = (
                     [-80, -65, -55] + list(range(-45, 46, 5)) + [55, 65, 80]
@@ -146,8 +157,9 @@ def dynamic_mix_data_prep(hparams):
                         ),
                     )
                     hrtf, sr = torchaudio.load(hrtf_file)
-                    transform = torchaudio.transforms.Resample(sr, fs_read)
-                    hrtf = transform(hrtf[:, np.random.randint(50)])
+                    hrtf = resample_hrtf(
+                        hrtf[:, np.random.randint(50)], sr, fs_read
+                    )
                     tmp_bi[:, i] = torch.from_numpy(
                         fftconvolve(tmp.numpy(), hrtf.numpy(), mode="same")
                     )
@@ -183,8 +195,9 @@ def dynamic_mix_data_prep(hparams):
             ],
         )
         mix_scaling = 1 / max_amp * 0.9
-        sources = mix_scaling * sources
-        mixture = mix_scaling * mixture
+        # sources and mixture are fresh tensors, so rescale them in place
+        sources.mul_(mix_scaling)
+        mixture.mul_(mix_scaling)
 
         yield mixture
         for i in range(hparams["num_spks"]):
@@ -212,6 +225,7 @@ def dynamic_mix_data_prep(hparams):
         train_data,
         batch_size=hparams["dataloader_opts"]["batch_size"],
         num_workers=hparams["dataloader_opts"]["num_workers"],
+        persistent_workers=hparams["dataloader_opts"]["num_workers"] > 0,
         collate_fn=PaddedBatch,
         worker_init_fn=lambda x: np.random.seed(
             int.from_bytes(os.urandom(4), "little") + x
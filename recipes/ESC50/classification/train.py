@@ -15,7 +15,9 @@ Based on the Urban8k recipe by
     * Ala Eddine Limame 2021
 """
 
+import json
 import os
+import shutil
 import sys
 
 import numpy as np
@@ -26,11 +28,15 @@ import torchvision
 from confusion_matrix_fig import create_cm_fig
 from esc50_prepare import prepare_esc50
 from hyperpyyaml import load_hyperpyyaml
-from sklearn.metrics import confusion_matrix
+from packaging import version
 from wham_prepare import combine_batches, prepare_wham
 
 import speechbrain as sb
+from speechbrain.utils.autocast import fwd_default_precision
 from speechbrain.utils.distributed import run_on_main
+from speechbrain.utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 
 class ESC50Brain(sb.core.Brain):
@@ -38,30 +44,29 @@ class ESC50Brain(sb.core.Brain):
 
     def compute_forward(self, batch, stage):
         """Computation pipeline based on an encoder + sound classifier."""
-        batch = batch.to(self.device)
-        wavs, lens = batch.sig
+        batch = batch.to(self.device, non_blocking=True)
 
-        # Augment if specified
-        if hasattr(self.hparams, "augmentation") and stage == sb.Stage.TRAIN:
-            wavs, lens = self.hparams.augmentation(wavs, lens)
+        if hasattr(batch, "mel"):
+            # Features were precomputed and cached on disk
+            net_input, lens = batch.mel
+        else:
+            wavs, lens = batch.sig
 
-        # augment batch with WHAM!
-        if hasattr(self.hparams, "add_wham_noise"):
-            if self.hparams.add_wham_noise:
-                wavs = combine_batches(wavs, iter(self.hparams.wham_dataset))
+            # Augment if specified
+            if (
+                hasattr(self.hparams, "augmentation")
+                and stage == sb.Stage.TRAIN
+            ):
+                wavs, lens = self.hparams.augmentation(wavs, lens)
 
-        X_stft = self.modules.compute_stft(wavs)
-        net_input = sb.processing.features.spectral_magnitude(
-            X_stft, power=self.hparams.spec_mag_power
-        )
-        if (
-            hasattr(self.hparams, "use_melspectra")
-            and self.hparams.use_melspectra
-        ):
-            net_input = self.modules.compute_fbank(net_input)
+            # augment batch with WHAM!
+            if hasattr(self.hparams, "add_wham_noise"):
+                if self.hparams.add_wham_noise:
+                    wavs = combine_batches(
+                        wavs, iter(self.hparams.wham_dataset)
+                    )
 
-        if (not self.hparams.use_melspectra) or self.hparams.use_log1p_mel:
-            net_input = torch.log1p(net_input)
+            net_input = self.modules.spectral_features(wavs)
 
         # Embeddings + sound classifier
         if hasattr(self.modules.embedding_model, "config"):
@@ -110,49 +115,35 @@ class ESC50Brain(sb.core.Brain):
 
         # Target augmentation
         N_augments = int(predictions.shape[0] / classid.shape[0])
-        classid = torch.cat(N_augments * [classid], dim=0)
+        classid = classid.repeat(N_augments, 1)
 
         # loss = self.hparams.compute_cost(predictions.squeeze(1), classid, lens)
-        target = F.one_hot(
-            classid.squeeze(), num_classes=self.hparams.out_n_neurons
-        )
-        loss = (
-            -(F.log_softmax(predictions.squeeze(1), 1) * target).sum(1).mean()
-        )
+        loss = F.cross_entropy(predictions.squeeze(1), classid.squeeze(-1))
 
         if stage != sb.Stage.TEST:
             if hasattr(self.hparams.lr_annealing, "on_batch_end"):
                 self.hparams.lr_annealing.on_batch_end(self.optimizer)
 
-        # Append this batch of losses to the loss metric
-        self.loss_metric.append(
-            uttid, predictions, classid, lens, reduction="batch"
-        )
-
-        # Confusion matrices
+        # Confusion matrices (accumulated on the device, so that there is no
+        # host synchronization for every batch)
         if stage != sb.Stage.TRAIN:
-            y_true = classid.cpu().detach().numpy().squeeze(-1)
-            y_pred = predictions.cpu().detach().numpy().argmax(-1).squeeze(-1)
+            n_classes = self.hparams.out_n_neurons
+            y_true = classid.view(-1)
+            y_pred = predictions.detach().argmax(-1).view(-1)
+            confusion_matix = torch.bincount(
+                y_true * n_classes + y_pred, minlength=n_classes**2
+            ).view(n_classes, n_classes)
 
         if stage == sb.Stage.VALID:
-            confusion_matix = confusion_matrix(
-                y_true,
-                y_pred,
-                labels=sorted(self.hparams.label_encoder.ind2lab.keys()),
-            )
             self.valid_confusion_matrix += confusion_matix
         if stage == sb.Stage.TEST:
-            confusion_matix = confusion_matrix(
-                y_true,
-                y_pred,
-                labels=sorted(self.hparams.label_encoder.ind2lab.keys()),
-            )
             self.test_confusion_matrix += confusion_matix
 
-        # Compute accuracy using MetricStats
-        self.acc_metric.append(
-            uttid, predict=predictions, target=classid, lengths=lens
-        )
+        # Update the running accuracy counters (kept on the device)
+        self.n_correct += (
+            predictions.detach().argmax(-1).view(-1) == classid.view(-1)
+        ).sum()
+        self.n_total += classid.numel()
 
         if stage != sb.Stage.TRAIN:
             self.error_metrics.append(uttid, predictions, classid, lens)
@@ -170,35 +161,24 @@ class ESC50Brain(sb.core.Brain):
             The currently-starting epoch. This is passed
             `None` during the test stage.
         """
-        # Set up statistics trackers for this stage
-        self.loss_metric = sb.utils.metric_stats.MetricStats(
-            metric=sb.nnet.losses.nll_loss
-        )
 
-        # Compute accuracy using MetricStats
-        # Define function taking (prediction, target, length) for eval
-        def accuracy_value(predict, target, lengths):
-            """Computes accuracy."""
-            nbr_correct, nbr_total = sb.utils.Accuracy.Accuracy(
-                predict, target, lengths
-            )
-            acc = torch.tensor([nbr_correct / nbr_total])
-            return acc
-
-        self.acc_metric = sb.utils.metric_stats.MetricStats(
-            metric=accuracy_value, n_jobs=1
-        )
+        # Set up statistics trackers for this stage:
+        # accuracy is accumulated as running (correct, total) counters
+        self.n_correct = torch.zeros((), dtype=torch.long, device=self.device)
+        self.n_total = 0
 
         # Confusion matrices
         if stage == sb.Stage.VALID:
-            self.valid_confusion_matrix = np.zeros(
-                shape=(self.hparams.out_n_neurons, self.hparams.out_n_neurons),
-                dtype=int,
+            self.valid_confusion_matrix = torch.zeros(
+                (self.hparams.out_n_neurons, self.hparams.out_n_neurons),
+                dtype=torch.long,
+                device=self.device,
             )
         if stage == sb.Stage.TEST:
-            self.test_confusion_matrix = np.zeros(
-                shape=(self.hparams.out_n_neurons, self.hparams.out_n_neurons),
-                dtype=int,
+            self.test_confusion_matrix = torch.zeros(
+                (self.hparams.out_n_neurons, self.hparams.out_n_neurons),
+                dtype=torch.long,
+                device=self.device,
             )
 
         # Set up evaluation-only statistics trackers
@@ -223,20 +203,20 @@ class ESC50Brain(sb.core.Brain):
             self.train_loss = stage_loss
             self.train_stats = {
                 "loss": self.train_loss,
-                "acc": self.acc_metric.summarize("average"),
+                "acc": self.n_correct.item() / self.n_total,
             }
         # Summarize Valid statistics from the stage for record-keeping
         elif stage == sb.Stage.VALID:
             valid_stats = {
                 "loss": stage_loss,
-                "acc": self.acc_metric.summarize("average"),
+                "acc": self.n_correct.item() / self.n_total,
                 "error": self.error_metrics.summarize("average"),
             }
         # Summarize Test statistics from the stage for record-keeping
         else:
             test_stats = {
                 "loss": stage_loss,
-                "acc": self.acc_metric.summarize("average"),
+                "acc": self.n_correct.item() / self.n_total,
                 "error": self.error_metrics.summarize("average"),
             }
 
@@ -254,7 +234,7 @@ class ESC50Brain(sb.core.Brain):
                 )
                 # Log confusion matrix fig to tensorboard
                 cm_fig = create_cm_fig(
-                    self.valid_confusion_matrix,
+                    self.valid_confusion_matrix.cpu().numpy(),
                     display_labels=list(
                         self.hparams.label_encoder.ind2lab.values()
                     ),
@@ -276,6 +256,11 @@ class ESC50Brain(sb.core.Brain):
 
         # We also write statistics about test data to stdout and to the log file
         if stage == sb.Stage.TEST:
+            # Single device-to-host copy of the confusion matrix
+            self.test_confusion_matrix = (
+                self.test_confusion_matrix.cpu().numpy()
+            )
+
             # Per class accuracy from Test confusion matrix
             per_class_acc_arr = np.diag(self.test_confusion_matrix) / np.sum(
                 self.test_confusion_matrix, axis=1
@@ -297,19 +282,205 @@ class ESC50Brain(sb.core.Brain):
             )
 
 
+class SpectralFeatures(torch.nn.Module):
+    """Computes the (log1p) magnitude or mel spectrogram fed to the classifier.
+
+    The whole feature extraction is wrapped in a single module, so that it can
+    be fused into a few kernels with ``--compile`` (or
+    ``--compile_module_keys=[spectral_features]``). The features are always
+    computed in fp32, even when training with ``--precision=bf16``, as the STFT
+    is not reliable in reduced precision.
+
+    Arguments
+    ---------
+    compute_stft : torch.nn.Module
+        The STFT module.
+    compute_fbank : torch.nn.Module
+        The filterbank module, only used when ``use_melspectra`` is True.
+    spec_mag_power : float
+        Power applied to the magnitude of the STFT.
+    use_melspectra : bool
+        Whether to apply the filterbank on top of the magnitude spectrogram.
+    use_log1p_mel : bool
+        Whether to compress the mel spectrogram with ``log1p``.
+    """
+
+    def __init__(
+        self,
+        compute_stft,
+        compute_fbank=None,
+        spec_mag_power=0.5,
+        use_melspectra=False,
+        use_log1p_mel=False,
+    ):
+        super().__init__()
+        self.compute_stft = compute_stft
+        self.compute_fbank = compute_fbank
+        self.spec_mag_power = spec_mag_power
+        self.use_melspectra = use_melspectra
+        self.use_log1p = (not use_melspectra) or use_log1p_mel
+
+    @fwd_default_precision(cast_inputs=torch.float32)
+    def forward(self, wavs):
+        """Returns the classifier input features.
+
+        Arguments
+        ---------
+        wavs : torch.Tensor
+            Batch of waveforms, shape [batch, time].
+
+        Returns
+        -------
+        net_input : torch.Tensor
+            The classifier input features, shape [batch, frames, bins].
+        """
+        X_stft = self.compute_stft(wavs)
+        net_input = sb.processing.features.spectral_magnitude(
+            X_stft, power=self.spec_mag_power
+        )
+        if self.use_melspectra:
+            net_input = self.compute_fbank(net_input)
+
+        if self.use_log1p:
+            net_input = torch.log1p(net_input)
+        return net_input
+
+    def settings(self):
+        """Returns the settings that determine the features, so that cached
+        features can be checked against the current configuration.
+
+        Returns
+        -------
+        settings : dict
+            The scalar attributes of this module and of its submodules.
+        """
+        return {
+            name
+            or "features": {
+                key: value
+                for key, value in vars(module).items()
+                if isinstance(value, (bool, int, float, str))
+                and key != "training"
+            }
+            for name, module in self.named_modules()
+        }
+
+
+def prepare_feature_cache(features_folder, settings):
+    """Creates the feature cache folder, emptying it first if its features
+    were computed with other settings.
+
+    Arguments
+    ---------
+    features_folder : str
+        Folder storing one feature file per utterance.
+    settings : dict
+        The settings the features are computed with, stored in the folder.
+
+    Returns
+    -------
+    None
+    """
+    settings_file = os.path.join(features_folder, "settings.json")
+    if os.path.exists(settings_file):
+        with open(settings_file) as fin:
+            if json.load(fin) == settings:
+                return
+
+    if os.path.exists(features_folder):
+        logger.info("Feature settings changed, emptying the feature cache")
+        shutil.rmtree(features_folder)
+    os.makedirs(features_folder)
+    with open(settings_file, "w") as fout:
+        json.dump(settings, fout)
+
+
+def create_audio_memmap(
+    json_files,
+    memmap_file,
+    index_file,
+    audio_pipeline,
+    signal_length,
+    sample_rate,
+):
+    """Decodes every file listed in the manifests once, and packs the
+    (downmixed, resampled, padded) waveforms into a single float16
+    memory-mapped array, with one row per utterance.
+
+    An existing array is reused only if its index was written for the same
+    signal length, sample rate and utterances, otherwise it is rebuilt.
+
+    Arguments
+    ---------
+    json_files : list of str
+        The json manifests listing the utterances to store.
+    memmap_file : str
+        Path of the memory-mapped array (created if missing).
+    index_file : str
+        Path of the json file mapping each utterance id to its row.
+    audio_pipeline : callable
+        Function loading a waveform of length ``signal_length`` from the
+        ``wav`` and ``peak`` fields of the manifest.
+    signal_length : int
+        Length (in samples) of all the waveforms.
+    sample_rate : int
+        Sample rate of all the waveforms.
+
+    Returns
+    -------
+    None
+    """
+    entries = {}
+    for json_file in json_files:
+        with open(json_file) as fin:
+            entries.update(json.load(fin))
+
+    index = {
+        "signal_length": signal_length,
+        "sample_rate": sample_rate,
+        "rows": {uttid: row for row, uttid in enumerate(entries)},
+    }
+    if os.path.exists(index_file) and os.path.exists(memmap_file):
+        with open(index_file) as fin:
+            if json.load(fin) == index:
+                return
+        logger.info("Audio memmap settings changed, rebuilding it")
+
+    # Remove the stale index first, so that an interrupted rebuild is never
+    # taken for a complete array
+    if os.path.exists(index_file):
+        os.remove(index_file)
+
+    rows = index["rows"]
+    audio = np.memmap(
+        memmap_file,
+        dtype=np.float16,
+        mode="w+",
+        shape=(len(rows), signal_length),
+    )
+    for uttid, row in rows.items():
+        entry = entries[uttid]
+        audio[row] = audio_pipeline(entry["wav"], entry["peak"]).numpy()
+    audio.flush()
+
+    # The index is written last, it marks the array as complete
+    with open(index_file, "w") as fout:
+        json.dump(index, fout)
+
+
 def dataio_prep(hparams):
     """Creates the datasets and their data processing pipelines."""
     data_audio_folder = hparams["audio_data_folder"]
     config_sample_rate = hparams["sample_rate"]
+    signal_length = int(hparams["signal_length_s"] * config_sample_rate)
     label_encoder = sb.dataio.encoder.CategoricalEncoder()
-    hparams["resampler"] = torchaudio.transforms.Resample(
-        new_freq=config_sample_rate
-    )
+    # One resampler per source sample rate, created the first time it is seen
+    resamplers = {}
 
     # 2. Define audio pipeline:
-    @sb.utils.data_pipeline.takes("wav")
+    @sb.utils.data_pipeline.takes("wav", "peak")
     @sb.utils.data_pipeline.provides("sig")
-    def audio_pipeline(wav):
+    def audio_pipeline(wav, peak):
         """Load the signal, and pass it and its length to the corruption class.
         This is done on the CPU in the `collate_fn`."""
 
@@ -324,17 +495,22 @@ def dataio_prep(hparams):
 
         # Convert sample rate to required config_sample_rate
         if read_sr != config_sample_rate:
-            # Re-initialize sampler if source file sample rate changed compared to last file
-            if read_sr != hparams["resampler"].orig_freq:
-                hparams["resampler"] = torchaudio.transforms.Resample(
+            if read_sr not in resamplers:
+                resamplers[read_sr] = torchaudio.transforms.Resample(
                     orig_freq=read_sr, new_freq=config_sample_rate
                 )
             # Resample audio
-            sig = hparams["resampler"].forward(sig)
+            sig = resamplers[read_sr](sig)
 
+        # Peak normalization, with the peak precomputed in the manifest (at
+        # the native sample rate, see esc50_prepare.create_json)
         sig = sig.float()
-        sig = sig / sig.max()
-        return sig
+        sig = sig / peak
+
+        # Pad (or crop) to a fixed length: all the batches then share the same
+        # shape, which lets the caching allocator reuse the same blocks
+        sig = F.pad(sig, (0, max(0, signal_length - sig.shape[-1])))
+        return sig[:signal_length]
 
     # 3. Define label pipeline:
     @sb.utils.data_pipeline.takes("class_string")
@@ -345,6 +521,111 @@ def dataio_prep(hparams):
         class_string_encoded = label_encoder.encode_label_torch(class_string)
         yield class_string_encoded
 
+    # 4. Define the cached feature pipeline:
+    # The STFT/fbank features are deterministic for each file, so they are
+    # computed once and stored on disk. This is only possible when the
+    # waveform is not modified on-the-fly (augmentation or WHAM! noise).
+    use_feature_cache = (
+        hparams.get("cache_features", False)
+        and "augmentation" not in hparams
+        and not hparams.get("add_wham_noise", False)
+    )
+    features_folder = os.path.join(hparams["save_folder"], "features")
+    if use_feature_cache:
+        run_on_main(
+            prepare_feature_cache,
+            kwargs={
+                "features_folder": features_folder,
+                "settings": {
+                    "signal_length": signal_length,
+                    "sample_rate": config_sample_rate,
+                    "modules": hparams["spectral_features"].settings(),
+                },
+            },
+        )
+    # Memory-mapped loading saves a copy, but needs torch >= 2.1
+    load_kwargs = {}
+    if version.parse(torch.__version__) >= version.parse("2.1.0"):
+        load_kwargs["mmap"] = True
+
+    # The features of the cache misses are computed on the CPU, inside the
+    # dataloader workers. As all the signals have the same length, the
+    # feature extraction is traced once (per worker) with TorchScript, which
+    # removes the Python overhead of the STFT/fbank modules.
+    traced_features = {}
+
+    @sb.utils.data_pipeline.takes("id", "wav", "peak")
+    @sb.utils.data_pipeline.provides("mel")
+    def feature_pipeline(uttid, wav, peak):
+        """Loads the features of an utterance from the cache, computing and
+        storing them the first time the utterance is seen."""
+        feature_file = os.path.join(features_folder, f"{uttid}.pt")
+        if os.path.exists(feature_file):
+            return torch.load(feature_file, **load_kwargs)
+
+        sig = audio_pipeline(wav, peak).unsqueeze(0)
+        with torch.no_grad():
+            if "module" not in traced_features:
+                traced_features["module"] = torch.jit.trace(
+                    hparams["spectral_features"], sig
+                )
+            mel = traced_features["module"](sig).squeeze(0)
+
+        # Write to a temporary file first, so that concurrent workers never
+        # read a partially written cache entry
+        tmp_file = f"{feature_file}.{os.getpid()}.tmp"
+        torch.save(mel, tmp_file)
+        os.replace(tmp_file, feature_file)
+        return mel
+
+    # 5. Define the memory-mapped audio pipeline:
+    # All the waveforms are decoded once and stored in a single array, so
+    # loading a signal is a slice instead of a file decode.
+    use_audio_memmap = hparams.get("use_audio_memmap", False)
+    memmap_file = os.path.join(hparams["save_folder"], "audio_memmap.f16")
+    index_file = os.path.join(hparams["save_folder"], "audio_memmap.json")
+    if use_audio_memmap and not use_feature_cache:
+        run_on_main(
+            create_audio_memmap,
+            kwargs={
+                "json_files": [
+                    hparams["train_annotation"],
+                    hparams["valid_annotation"],
+                    hparams["test_annotation"],
+                ],
+                "memmap_file": memmap_file,
+                "index_file": index_file,
+                "audio_pipeline": audio_pipeline,
+                "signal_length": signal_length,
+                "sample_rate": config_sample_rate,
+            },
+        )
+        with open(index_file) as fin:
+            memmap_rows = json.load(fin)["rows"]
+        audio_memmap = np.memmap(
+            memmap_file,
+            dtype=np.float16,
+            mode="r",
+            shape=(len(memmap_rows), signal_length),
+        )
+
+    @sb.utils.data_pipeline.takes("id")
+    @sb.utils.data_pipeline.provides("sig")
+    def memmap_audio_pipeline(uttid):
+        """Reads the signal from the memory-mapped array."""
+        sig = audio_memmap[memmap_rows[uttid]]
+        return torch.from_numpy(sig.astype(np.float32))
+
+    if use_feature_cache:
+        dynamic_items = [feature_pipeline, label_pipeline]
+        output_keys = ["id", "mel", "class_string_encoded"]
+    elif use_audio_memmap:
+        dynamic_items = [memmap_audio_pipeline, label_pipeline]
+        output_keys = ["id", "sig", "class_string_encoded"]
+    else:
+        dynamic_items = [audio_pipeline, label_pipeline]
+        output_keys = ["id", "sig", "class_string_encoded"]
+
     # Define datasets. We also connect the dataset with the data processing
     # functions defined above.
     datasets = {}
@@ -357,8 +638,8 @@ def dataio_prep(hparams):
         datasets[dataset] = sb.dataio.dataset.DynamicItemDataset.from_json(
             json_path=data_info[dataset],
             replacements={"data_root": hparams["data_folder"]},
-            dynamic_items=[audio_pipeline, label_pipeline],
-            output_keys=["id", "sig", "class_string_encoded"],
+            dynamic_items=dynamic_items,
+            output_keys=output_keys,
         )
 
     # Load or compute the label encoder (with multi-GPU DDP support)
@@ -381,13 +662,20 @@ if __name__ == "__main__":
     # CLI:
     hparams_file, run_opts, overrides = sb.parse_arguments(sys.argv[1:])
 
-    # Initialize ddp (useful only for multi-GPU DDP training)
-    sb.utils.distributed.ddp_init_group(run_opts)
-
     # Load hyperparameters file with command-line overrides
     with open(hparams_file) as fin:
         hparams = load_hyperpyyaml(fin, overrides)
 
+    # Expandable segments avoid re-allocating CUDA memory every time the
+    # batch shape changes. This must be set before the first CUDA allocation.
+    if hparams.get("use_expandable_segments", True):
+        os.environ.setdefault(
+            "PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True"
+        )
+
+    # Initialize ddp (useful only for multi-GPU DDP training)
+    sb.utils.distributed.ddp_init_group(run_opts)
+
     # Create experiment directory
     sb.create_experiment_directory(
         experiment_directory=hparams["output_folder"],
@@ -418,6 +706,16 @@ if __name__ == "__main__":
         },
     )
 
+    # Bundle the feature extraction into a single (compilable) module
+    hparams["spectral_features"] = SpectralFeatures(
+        compute_stft=hparams["compute_stft"],
+        compute_fbank=hparams.get("compute_fbank"),
+        spec_mag_power=hparams["spec_mag_power"],
+        use_melspectra=hparams["use_melspectra"],
+        use_log1p_mel=hparams["use_log1p_mel"],
+    )
+    hparams["modules"]["spectral_features"] = hparams["spectral_features"]
+
     # Dataset IO prep: creating Dataset objects and proper encodings for phones
     datasets, label_encoder = dataio_prep(hparams)
     hparams["label_encoder"] = label_encoder
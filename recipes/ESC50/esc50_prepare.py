@@ -177,9 +177,16 @@ def prepare_esc50(
 
     # If the dataset doesn't exist yet, prompt the user to set or download it
 
-    # Don't need to do this every single time
+    # Don't need to do this every single time, unless the manifests were
+    # created by an older version of this script, without the signal peaks
     if skip_manifest_creation is True:
-        return
+        if manifests_have_peaks(
+            [save_json_train, save_json_valid, save_json_test]
+        ):
+            return
+        logger.info(
+            "The existing manifests have no 'peak' field, creating them again."
+        )
 
     # If our modified metadata file does not exist, create it
     esc50_speechbrain_metadata_csv_path = os.path.join(
@@ -243,6 +250,14 @@ def create_json(metadata, audio_data_folder, folds_list, json_file):
                 else:
                     duration = signal.shape[0] / file_info[0].rate
 
+                # Peak of the (downmixed) signal, used to normalize it when
+                # loading, without a reduction over the waveform every epoch.
+                # It is measured at the native sample rate, so it can differ
+                # slightly from the peak of the resampled signal.
+                if signal.dim() > 1:
+                    signal = signal.mean(dim=-1)
+                peak = signal.max().item()
+
                 # Create entry for this sample ONLY if we have successfully read-in the file using SpeechBrain/torchaudio
                 json_dict[ID] = {
                     "wav": sample_metadata["filename"],
@@ -251,6 +266,7 @@ def create_json(metadata, audio_data_folder, folds_list, json_file):
                     # "salience": int(sample_metadata["salience"]),
                     "fold": sample_metadata["fold"],
                     "duration": duration,
+                    "peak": peak,
                 }
             except Exception:
                 print(
@@ -272,6 +288,29 @@ def create_json(metadata, audio_data_folder, folds_list, json_file):
     logger.info(f"{json_file} successfully created!")
 
 
+def manifests_have_peaks(json_files):
+    """Returns True if all the json files exist and every entry has a peak.
+
+    Arguments
+    ---------
+    json_files : list of str
+        Paths of the manifest files to check.
+
+    Returns
+    -------
+    have_peaks : bool
+        Whether the manifests can be used as they are.
+    """
+    for json_file in json_files:
+        if not os.path.exists(json_file):
+            return False
+        with open(json_file) as json_f:
+            entries = json.load(json_f)
+        if any("peak" not in entry for entry in entries.values()):
+            return False
+    return True
+
+
 def folds_overlap(list1, list2):
     """Returns True if any passed lists has incorrect type OR has items in common.
 
@@ -11,6 +11,7 @@ Authors
     * Luca Della Libera 2024
 """
 
+import math
 import os
 import sys
 
@@ -121,9 +122,13 @@ class InterpreterESC50Brain(sb.core.Brain):
         predictions = self.hparams.classifier(embeddings).squeeze(1)
         class_pred = predictions.argmax(1)
 
-        threshold = xhat.reshape(len(xhat), -1).quantile(
-            self.hparams.quantile, dim=-1
-        )[:, None, None, None]
+        # Binarize at the q-th quantile. Selecting the k-th smallest value is
+        # linear in the mask size (torch.quantile sorts it), and thresholding
+        # at the value right above the interpolated quantile gives the same
+        # binary mask
+        xhat_flat = xhat.reshape(len(xhat), -1)
+        k = math.ceil(self.hparams.quantile * (xhat_flat.shape[-1] - 1)) + 1
+        threshold = xhat_flat.kthvalue(k, dim=-1).values[:, None, None, None]
         xhat[xhat < threshold] = -float("inf")
         xhat[xhat >= threshold] = float("inf")
 
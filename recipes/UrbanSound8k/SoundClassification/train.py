@@ -281,9 +281,8 @@ def dataio_prep(hparams):
     label_encoder = sb.dataio.encoder.CategoricalEncoder()
     # TODO  use SB implementation but need to make sure it give the same results as PyTorch
     # resampler = sb.processing.speech_augmentation.Resample(orig_freq=latest_file_sr, new_freq=config_sample_rate)
-    hparams["resampler"] = torchaudio.transforms.Resample(
-        new_freq=config_sample_rate
-    )
+    # One resampler per source sample rate, created the first time it is seen
+    resamplers = {}
 
     # 2. Define audio pipeline:
     @sb.utils.data_pipeline.takes("wav", "fold")
@@ -303,13 +302,12 @@ def dataio_prep(hparams):
 
         # Convert sample rate to required config_sample_rate
         if read_sr != config_sample_rate:
-            # Re-initialize sampler if source file sample rate changed compared to last file
-            if read_sr != hparams["resampler"].orig_freq:
-                hparams["resampler"] = torchaudio.transforms.Resample(
+            if read_sr not in resamplers:
+                resamplers[read_sr] = torchaudio.transforms.Resample(
                     orig_freq=read_sr, new_freq=config_sample_rate
                 )
             # Resample audio
-            sig = hparams["resampler"].forward(sig)
+            sig = resamplers[read_sr](sig)
 
         return sig
 
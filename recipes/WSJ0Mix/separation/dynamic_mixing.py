@@ -110,9 +110,9 @@ def dynamic_mix_data_prep(hparams):
         )
 
         if "wham" in Path(hparams["data_folder"]).stem:
-            noise_file = np.random.choice(noise_files, 1, replace=False)
+            noise_file = noise_files[np.random.randint(len(noise_files))]
 
-            noise, fs_read = torchaudio.load(noise_file[0])
+            noise, fs_read = torchaudio.load(noise_file)
             noise = noise.squeeze()
             # gain = np.clip(random.normalvariate(1, 10), -4, 15)
             # noise = rescale(noise, torch.tensor(len(noise)), gain, scale="dB").squeeze()
@@ -122,18 +122,15 @@ def dynamic_mix_data_prep(hparams):
         first_lvl = None
 
         spk_files = [
-            np.random.choice(spk_hashtable[spk], 1, False)[0]
+            spk_hashtable[spk][np.random.randint(len(spk_hashtable[spk]))]
             for spk in speakers
         ]
 
-        minlen = min(
-            *[torchaudio.info(x).num_frames for x in spk_files],
-            hparams["training_signal_len"],
-        )
+        lengths = [torchaudio.info(x).num_frames for x in spk_files]
+        minlen = min(*lengths, hparams["training_signal_len"])
 
-        for i, spk_file in enumerate(spk_files):
+        for i, (spk_file, length) in enumerate(zip(spk_files, lengths)):
             # select random offset
-            length = torchaudio.info(spk_file).num_frames
             start = 0
             stop = length
             if length > minlen:  # take a random window
@@ -181,8 +178,9 @@ def dynamic_mix_data_prep(hparams):
             *[x.item() for x in torch.abs(sources).max(dim=-1)[0]],
         )
         mix_scaling = 1 / max_amp * 0.9
-        sources = mix_scaling * sources
-        mixture = mix_scaling * mixture
+        # sources and mixture are fresh tensors, so rescale them in place
+        sources.mul_(mix_scaling)
+        mixture.mul_(mix_scaling)
 
         yield mixture
         for i in range(hparams["num_spks"]):
@@ -210,6 +208,7 @@ def dynamic_mix_data_prep(hparams):
         train_data,
         batch_size=hparams["dataloader_opts"]["batch_size"],
         num_workers=hparams["dataloader_opts"]["num_workers"],
+        persistent_workers=hparams["dataloader_opts"]["num_workers"] > 0,
         collate_fn=PaddedBatch,
         worker_init_fn=lambda x: np.random.seed(
             int.from_bytes(os.urandom(4), "little") + x
@@ -35,12 +35,12 @@ Authors:
   * Aku Rouhe 2020
 """
 
-import functools
+import itertools
 import os
 import warnings
 
+import torch
 from torch.utils.data import DataLoader, DistributedSampler, IterableDataset
-from torch.utils.data.dataloader import _BaseDataLoaderIter
 
 from speechbrain.dataio.batch import BatchsizeGuesser, PaddedBatch
 from speechbrain.dataio.dataset import DynamicItemDataset
@@ -153,6 +153,14 @@ def make_dataloader(dataset, looped_nominal_epoch=None, **loader_kwargs):
     If the Dataset is a webdataset.dataset.Composable, set default
     batch_size = None.
 
+    Memory is pinned by default when CUDA is available, and loaders that use
+    worker processes keep them alive across epochs (``persistent_workers``)
+    and prefetch 4 batches per worker. Any of these can be overridden through
+    loader_kwargs. Note that this changes the behavior of earlier versions:
+    with persistent workers, changes made to the dataset in the main process
+    after the first epoch (e.g. new dynamic items or output keys) do not
+    reach the workers, so pass ``persistent_workers=False`` in that case.
+
     Can also loop over the underlying dataloader continuously,
     and stop iterations at nominal epoch lengths.
 
@@ -204,6 +212,18 @@ def make_dataloader(dataset, looped_nominal_epoch=None, **loader_kwargs):
         and "batch_size" not in loader_kwargs
     ):
         loader_kwargs["batch_size"] = None
+    # Pinned memory makes the host to device copies faster (and allows them
+    # to be non-blocking). Persistent workers avoid re-spawning the worker
+    # processes at every epoch.
+    loader_kwargs.setdefault("pin_memory", torch.cuda.is_available())
+    if loader_kwargs.get("num_workers", 0) > 0:
+        if loader_kwargs.get("persistent_workers") is False:
+            logger.info(
+                "persistent_workers=False: the worker processes will be "
+                "re-spawned at every epoch."
+            )
+        loader_kwargs.setdefault("persistent_workers", True)
+        loader_kwargs.setdefault("prefetch_factor", 4)
     # Create the loader
     if isinstance(dataset, IterableDataset):
         dataloader = DataLoader(dataset, **loader_kwargs)
@@ -214,51 +234,38 @@ def make_dataloader(dataset, looped_nominal_epoch=None, **loader_kwargs):
     return dataloader
 
 
-# We essentially want to make the DataLoader iterators able to skip ahead
-# after checkpoint recovery
-# This should be handled by the DataLoader iterators' base class.
-# To make the implementation here a little more maintainable
-# we decide to patch some PyTorch functionality
+class _SkipSampler:
+    """Wraps a (batch) sampler, skipping its first indices on every iteration.
 
+    Used to fast-forward a SaveableDataLoader after checkpoint recovery.
 
-def __new_init(self, loader, *args, **kwargs):
-    self.__old_init__(loader, *args, **kwargs)
-    if (
-        hasattr(loader, "_speechbrain_recovery_skip_to")
-        and loader._speechbrain_recovery_skip_to is not None
-    ):
-        # Fast forward the sampler iterator since we have recovered:
-        for i in range(loader._speechbrain_recovery_skip_to):
-            try:
-                next(self._sampler_iter)
-            except StopIteration:
-                MSG = "Tried to fast-forward Sampler after checkpoint "
-                f"recovery by {loader._speechbrain_recovery_skip_to} "
-                "indices, but now Sampler raised StopIteration after "
-                f"{i} indices. Ignoring this mismatch."
-                warnings.warn(MSG)
-                break
-            self._num_yielded = i + 1
-        # Mark recovery as done:
-        loader._speechbrain_recovery_skip_to = None
-
-
-def __new_reset(self, loader, first_iter=False, *args, **kwargs):
-    # On the first iteration, these have already normally been set by the init anyway.
-    # And we don't want to overwrite them if we've recovered
-    if not first_iter:
-        self._sampler_iter = iter(self._index_sampler)
-        self._num_yielded = 0
-        self._IterableDataset_len_called = loader._IterableDataset_len_called
-
-
-# functools.update_wrapper is meant for decorators, but it should basically
-# preserve what we want:
-functools.update_wrapper(__new_init, _BaseDataLoaderIter.__init__)
-_BaseDataLoaderIter.__old_init__ = _BaseDataLoaderIter.__init__
-_BaseDataLoaderIter.__init__ = __new_init
-if hasattr(_BaseDataLoaderIter, "_reset"):
-    _BaseDataLoaderIter._reset = __new_reset
+    Arguments
+    ---------
+    sampler : Sampler
+        The sampler of the DataLoader (or its batch sampler).
+    skip : int
+        How many indices (batches, for a batch sampler) to skip.
+    """
+
+    def __init__(self, sampler, skip):
+        self.sampler = sampler
+        self.skip = skip
+
+    def __iter__(self):
+        iterator = iter(self.sampler)
+        if self.skip > 0:
+            # itertools consumes the skipped indices without a Python loop
+            last = next(itertools.islice(iterator, self.skip - 1, None), None)
+            if last is None:
+                warnings.warn(
+                    "Tried to fast-forward Sampler after checkpoint recovery "
+                    f"by {self.skip} indices, but the Sampler ran out of "
+                    "indices before that. Ignoring this mismatch."
+                )
+        return iterator
+
+    def __len__(self):
+        return len(self.sampler)
 
 
 @register_checkpoint_hooks
@@ -291,8 +298,26 @@ class SaveableDataLoader(DataLoader):
         self._speechbrain_recovery_skip_to = None
         self._speechbrain_iterator = None
 
+    @property
+    def _index_sampler(self):
+        # DataLoader iterators draw their indices from here. After checkpoint
+        # recovery, skip to where we left off.
+        index_sampler = super()._index_sampler
+        skip_to = getattr(self, "_speechbrain_recovery_skip_to", None)
+        if skip_to is not None:
+            index_sampler = _SkipSampler(index_sampler, skip_to)
+        return index_sampler
+
     def __iter__(self):
+        skip_to = self._speechbrain_recovery_skip_to
         iterator = super().__iter__()
+        if skip_to is not None:
+            # Recovery is done: the iterator counts from the recovered
+            # position and, if it is reused by persistent workers, the
+            # following epochs are not skipped anymore.
+            self._speechbrain_recovery_skip_to = None
+            iterator._index_sampler = self._index_sampler
+            iterator._num_yielded = skip_to
         # Keep a reference to the iterator,
         # to be able to access the iterator._num_yielded value.
         # Keep a full reference (keeping the iterator alive)
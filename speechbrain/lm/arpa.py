@@ -76,9 +76,9 @@ def read_arpa(fstream):
 
     Arguments
     ---------
-    fstream : TextIO
+    fstream : TextIO | str | Path
         Text file stream (as commonly returned by open()) to read the model
-        from.
+        from, or the path of the ARPA file.
 
     Returns
     -------
@@ -117,6 +117,9 @@ def read_arpa(fstream):
     ValueError
         If no LM is found or the file is badly formatted.
     """
+    if isinstance(fstream, (str, Path)):
+        with open(fstream, encoding="utf-8") as fin:
+            return read_arpa(fin)
     # Developer's note:
     # This is a long function.
     # It is because we support cases where a new section starts suddenly without
@@ -148,8 +151,11 @@ def read_arpa(fstream):
     # \N-grams: sections
     # NOTE: This is the section that most time is spent on, so it's been written
     # with processing speed in mind.
+    # The tokens are interned, so that every N-gram containing a token
+    # references the same string object instead of holding its own copy.
     ngrams_by_order = {}
     backoffs_by_order = {}
+    intern = {}.setdefault  # intern(token, token) returns the shared token
     while not ended:
         probs = collections.defaultdict(dict)
         backoffs = {}
@@ -157,20 +163,18 @@ def read_arpa(fstream):
         # Use try-except because it is faster than always checking
         try:
             for line in fstream:
-                line = line.strip()
-                all_parts = tuple(line.split())
+                all_parts = line.split()
                 prob = float(all_parts[0])
                 if len(all_parts) == backoff_line_length:
-                    context = all_parts[1:-2]
-                    token = all_parts[-2]
-                    backoff = float(all_parts[-1])
-                    backoff_context = context + (token,)
-                    backoffs[backoff_context] = backoff
+                    tokens = all_parts[1:-1]
+                    ngram = tuple(map(intern, tokens, tokens))
+                    backoffs[ngram] = float(all_parts[-1])
                 else:
-                    context = all_parts[1:-1]
-                    token = all_parts[-1]
-                probs[context][token] = prob
+                    tokens = all_parts[1:]
+                    ngram = tuple(map(intern, tokens, tokens))
+                probs[ngram[:-1]][ngram[-1]] = prob
         except (IndexError, ValueError):
+            line = line.strip()
             ngrams_by_order[order] = probs
             backoffs_by_order[order] = backoffs
             if not line:  # Normal case, empty line ends section
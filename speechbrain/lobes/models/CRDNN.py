@@ -8,10 +8,54 @@ Authors
  * Abdel 2020
 """
 
+import inspect
+import time
+
 import torch
+import torch.nn.utils.fusion
+import torch.utils.checkpoint
 
 import speechbrain as sb
 
+# Activations without parameters or buffers, which can safely be shared
+# between all the blocks of the model
+_STATELESS_ACTIVATIONS = (
+    torch.nn.ReLU,
+    torch.nn.LeakyReLU,
+    torch.nn.GELU,
+    torch.nn.SiLU,
+)
+
+
+def _shared_activation(activation):
+    """Returns a callable building the activation layers of the model.
+
+    For the stateless activations, the same (in-place, if supported) instance
+    is returned on every call, so that the module tree holds a single module
+    instead of one per block. Other activations (e.g. PReLU) are returned
+    as is, so that each block gets its own parameters.
+
+    Arguments
+    ---------
+    activation : torch class
+        The class of the activation layers.
+
+    Returns
+    -------
+    A callable returning an activation layer.
+    """
+    if not (
+        isinstance(activation, type)
+        and issubclass(activation, _STATELESS_ACTIVATIONS)
+    ):
+        return activation
+
+    kwargs = {}
+    if "inplace" in inspect.signature(activation).parameters:
+        kwargs["inplace"] = True
+    shared = activation(**kwargs)
+    return lambda: shared
+
 
 class CRDNN(sb.nnet.containers.Sequential):
     """This model is a combination of CNNs, RNNs, and DNNs.
@@ -31,6 +75,8 @@ class CRDNN(sb.nnet.containers.Sequential):
         CRDNN into a sequential with other classes.
     activation : torch class
         A class used for constructing the activation layers for CNN and DNN.
+        Parameter-free activations (ReLU, LeakyReLU, GELU, SiLU) are
+        instantiated once, in-place where supported, and shared by all blocks.
     dropout : float
         Neuron dropout rate as applied to CNN, RNN, and DNN.
     cnn_blocks : int
@@ -39,6 +85,12 @@ class CRDNN(sb.nnet.containers.Sequential):
         A list of the number of output channels for each CNN block.
     cnn_kernelsize : tuple of ints
         The size of the convolutional kernels.
+    cnn_normalization : torch class
+        A class used for constructing the normalization layers of the CNN
+        blocks. The default LayerNorm normalizes over both the frequency and
+        channel axes. BatchNorm2d has a fused cuDNN kernel (also in
+        channels-last format) and is faster, but changes the model, so
+        existing checkpoints cannot be loaded with it.
     time_pooling : bool
         Whether to pool the utterance on the time axis before the RNN.
     time_pooling_size : int
@@ -70,6 +122,27 @@ class CRDNN(sb.nnet.containers.Sequential):
         representation obtained after the CNN blocks.
     use_rnnp: bool
         If True, a linear projection layer is added between RNN layers.
+    channels_last : bool
+        If True, the convolution weights of the CNN blocks are stored in
+        channels-last memory format, so that cuDNN uses its NHWC kernels.
+        This is mostly beneficial with fp16/bf16 on GPUs with Tensor Cores,
+        and can be slower in fp32. See ``tune_memory_format`` to pick the
+        faster layout for a given input by timing both.
+    checkpoint_activations : bool
+        If True, the activations of each CNN block are not kept for the
+        backward pass but recomputed, which reduces the training memory
+        (mostly used by the CNN on long utterances) at the cost of some
+        extra compute.
+    compile_cnn : bool
+        If True, the CNN blocks are compiled with ``torch.compile`` (requires
+        PyTorch >= 2.2), which fuses the normalization, activation, pooling
+        and dropout of each block. The first forward passes are slow, as
+        the blocks get compiled for each new input shape.
+    compile_mode : str
+        The ``mode`` given to ``torch.compile`` when ``compile_cnn`` is True.
+        Use "reduce-overhead" for small-batch or streaming inference on GPU
+        with fixed-size chunks: each block is then replayed as a CUDA graph,
+        with a single launch instead of one per kernel.
 
     Example
     -------
@@ -78,6 +151,14 @@ class CRDNN(sb.nnet.containers.Sequential):
     >>> outputs = model(inputs)
     >>> outputs.shape
     torch.Size([10, 15, 512])
+
+    The model can be compiled with TorchScript, e.g. to deploy it with
+    ``torch.jit.save`` or to feed ``torch.onnx.export`` for ONNX Runtime
+    or TensorRT.
+
+    >>> scripted = torch.jit.script(model.eval())
+    >>> torch.allclose(scripted(inputs), model(inputs))
+    True
     """
 
     def __init__(
@@ -89,6 +170,7 @@ class CRDNN(sb.nnet.containers.Sequential):
         cnn_blocks=2,
         cnn_channels=[128, 256],
         cnn_kernelsize=(3, 3),
+        cnn_normalization=sb.nnet.normalization.LayerNorm,
         time_pooling=False,
         time_pooling_size=2,
         freq_pooling_size=2,
@@ -103,6 +185,10 @@ class CRDNN(sb.nnet.containers.Sequential):
         dnn_neurons=512,
         projection_dim=-1,
         use_rnnp=False,
+        channels_last=False,
+        checkpoint_activations=False,
+        compile_cnn=False,
+        compile_mode="default",
     ):
         if input_size is None and input_shape is None:
             raise ValueError("Must specify one of input_size or input_shape")
@@ -110,6 +196,7 @@ class CRDNN(sb.nnet.containers.Sequential):
         if input_shape is None:
             input_shape = [None, None, input_size]
         super().__init__(input_shape=input_shape)
+        activation = _shared_activation(activation)
 
         if cnn_blocks > 0:
             self.append(sb.nnet.containers.Sequential, layer_name="CNN")
@@ -118,10 +205,13 @@ class CRDNN(sb.nnet.containers.Sequential):
                 CNN_Block,
                 channels=cnn_channels[block_index],
                 kernel_size=cnn_kernelsize,
+                normalization=cnn_normalization,
                 using_2d_pool=using_2d_pooling,
                 pooling_size=inter_layer_pooling_size[block_index],
                 activation=activation,
                 dropout=dropout,
+                channels_last=channels_last,
+                checkpoint_activations=checkpoint_activations,
                 layer_name=f"block_{block_index}",
             )
 
@@ -195,6 +285,163 @@ class CRDNN(sb.nnet.containers.Sequential):
                 layer_name=f"block_{block_index}",
             )
 
+        # Compiled last, so that the shape inference of the layers above
+        # does not trigger a compilation with dummy inputs
+        if compile_cnn and cnn_blocks > 0:
+            if not hasattr(torch.nn.Module, "compile"):
+                raise ValueError(
+                    "'compile_cnn' is specified, but this install of PyTorch "
+                    "seems to be too old to support it."
+                )
+            for block in self.CNN.values():
+                # Compiling in-place keeps the parameter names unchanged,
+                # so checkpoints are compatible with the eager model
+                block.compile(mode=compile_mode)
+
+    def tune_memory_format(self, x, n_iter=3):
+        """Times the CNN blocks with contiguous and channels-last convolution
+        weights, and keeps the faster layout.
+
+        Channels-last is usually faster with fp16/bf16 on GPUs with Tensor
+        Cores, but can be slower for some shapes and dtypes, so the easiest
+        way to know is to measure it on a representative batch before
+        training. The blocks are timed in eval mode, so that neither the
+        dropout masks nor the normalization statistics are affected, and the
+        gradients are not accumulated into the parameters.
+
+        Arguments
+        ---------
+        x : torch.Tensor
+            A representative input batch, on the device of the model.
+        n_iter : int
+            Number of timed forward and backward passes for each layout,
+            must be at least 1.
+
+        Returns
+        -------
+        memory_format : torch.memory_format
+            The memory format of the convolution weights that was kept.
+
+        Example
+        -------
+        >>> inputs = torch.rand([10, 15, 60])
+        >>> model = CRDNN(input_shape=inputs.shape)
+        >>> memory_format = model.tune_memory_format(inputs, n_iter=1)
+        >>> outputs = model(inputs)
+        >>> outputs.shape
+        torch.Size([10, 15, 512])
+        """
+        if n_iter < 1:
+            raise ValueError(f"n_iter must be at least 1, got {n_iter}.")
+        if "CNN" not in self:
+            return torch.contiguous_format
+
+        params = [p for p in self.CNN.parameters() if p.requires_grad]
+        # Weights with a single input channel fit both layouts, so the
+        # original layout is read from any weight that fits only one
+        if any(
+            p.dim() == 4 and not p.is_contiguous()
+            for p in self.CNN.parameters()
+        ):
+            original_format = torch.channels_last
+        else:
+            original_format = torch.contiguous_format
+        was_training = self.training
+        self.eval()
+
+        best = original_format
+        try:
+            timings = {}
+            for memory_format in (torch.contiguous_format, torch.channels_last):
+                self.CNN.to(memory_format=memory_format)
+                # The first pass is a warm-up, e.g. for cuDNN benchmark
+                out = self.CNN(x)
+                torch.autograd.grad(out.sum(), params)
+                if x.is_cuda:
+                    torch.cuda.synchronize(x.device)
+                start = time.perf_counter()
+                for _ in range(n_iter):
+                    out = self.CNN(x)
+                    torch.autograd.grad(out.sum(), params)
+                if x.is_cuda:
+                    torch.cuda.synchronize(x.device)
+                timings[memory_format] = time.perf_counter() - start
+            best = min(timings, key=timings.get)
+        finally:
+            # On failure, the layout the model had before tuning is restored
+            self.CNN.to(memory_format=best)
+            self.train(was_training)
+        return best
+
+    def fuse_for_inference(self):
+        """Folds the batch normalization of each DNN block into the weights
+        and bias of the preceding linear layer.
+
+        In eval mode, the normalization is a fixed affine transform, so it
+        can be merged into the linear layer, which saves one elementwise
+        pass over the activations per block. The model must be in eval mode
+        and the trained parameters loaded, as the running statistics are
+        folded as they are, and the normalization layers are replaced with
+        ``torch.nn.Identity`` so the state_dict changes. The normalization
+        layers of the CNN blocks depend on the statistics of each input,
+        so they cannot be folded and are left as they are. Calling this
+        again on a fused model does nothing.
+
+        Returns
+        -------
+        None
+
+        Example
+        -------
+        >>> inputs = torch.rand([10, 15, 60])
+        >>> model = CRDNN(input_shape=inputs.shape).eval()
+        >>> outputs = model(inputs)
+        >>> model.fuse_for_inference()
+        >>> torch.allclose(model(inputs), outputs, atol=1e-5)
+        True
+        >>> model.fuse_for_inference()
+        >>> torch.allclose(model(inputs), outputs, atol=1e-5)
+        True
+        """
+        if self.training:
+            raise ValueError(
+                "The batch normalization can only be folded in eval mode, "
+                "call model.eval() first."
+            )
+        if "DNN" not in self:
+            return
+
+        for block in self.DNN.values():
+            if isinstance(block.norm, torch.nn.Identity):
+                continue  # already folded
+            block.linear.w = torch.nn.utils.fusion.fuse_linear_bn_eval(
+                block.linear.w, block.norm.norm
+            )
+            block.norm = torch.nn.Identity()
+
+    def quantize_head(self):
+        """Dynamically quantizes the linear layers of the DNN blocks to int8.
+
+        This speeds up CPU inference of the fully-connected head, the CNN
+        and RNN layers are left in floating point. The quantized model can
+        only be used for inference on CPU, and its state_dict is not
+        compatible with the floating-point model anymore, so this should be
+        called after loading the trained parameters.
+
+        Example
+        -------
+        >>> inputs = torch.rand([10, 15, 60])
+        >>> model = CRDNN(input_shape=inputs.shape).eval()
+        >>> model.quantize_head()
+        >>> outputs = model(inputs)
+        >>> outputs.shape
+        torch.Size([10, 15, 512])
+        """
+        if "DNN" in self:
+            torch.ao.quantization.quantize_dynamic(
+                self.DNN, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+
 
 class CNN_Block(sb.nnet.containers.Sequential):
     """CNN Block, based on VGG blocks.
@@ -209,12 +456,20 @@ class CNN_Block(sb.nnet.containers.Sequential):
         Size of the 2d convolutional kernel
     activation : torch.nn.Module class
         A class to be used for instantiating an activation layer.
+    normalization : torch.nn.Module class
+        A class to be used for instantiating the normalization layers.
     using_2d_pool : bool
         Whether to use 2d pooling or only 1d pooling.
     pooling_size : int
         Size of pooling kernel, duplicated for 2d pooling.
     dropout : float
         Rate to use for dropping channels.
+    channels_last : bool
+        If True, the convolution weights are stored in channels-last memory
+        format, which makes cuDNN pick its NHWC kernels.
+    checkpoint_activations : bool
+        If True, the intermediate activations are recomputed during the
+        backward pass instead of being stored (training only).
 
     Example
     -------
@@ -229,28 +484,41 @@ class CNN_Block(sb.nnet.containers.Sequential):
         self,
         input_shape,
         channels,
-        kernel_size=[3, 3],
+        kernel_size=(3, 3),
         activation=torch.nn.LeakyReLU,
+        normalization=sb.nnet.normalization.LayerNorm,
         using_2d_pool=False,
         pooling_size=2,
         dropout=0.15,
+        channels_last=False,
+        checkpoint_activations=False,
     ):
         super().__init__(input_shape=input_shape)
+        self.checkpoint_activations = checkpoint_activations
+
+        # The "same" padded convolutions only change the number of channels,
+        # so the layers are given their shapes directly, without running
+        # dummy inputs through the block to infer them.
+        conv_shape = [*self.input_shape[:3], channels]
         self.append(
-            sb.nnet.CNN.Conv2d,
-            out_channels=channels,
-            kernel_size=kernel_size,
+            sb.nnet.CNN.Conv2d(
+                input_shape=self.input_shape,
+                out_channels=channels,
+                kernel_size=kernel_size,
+            ),
             layer_name="conv_1",
         )
-        self.append(sb.nnet.normalization.LayerNorm, layer_name="norm_1")
+        self.append(normalization(input_shape=conv_shape), layer_name="norm_1")
         self.append(activation(), layer_name="act_1")
         self.append(
-            sb.nnet.CNN.Conv2d,
-            out_channels=channels,
-            kernel_size=kernel_size,
+            sb.nnet.CNN.Conv2d(
+                in_channels=channels,
+                out_channels=channels,
+                kernel_size=kernel_size,
+            ),
             layer_name="conv_2",
         )
-        self.append(sb.nnet.normalization.LayerNorm, layer_name="norm_2")
+        self.append(normalization(input_shape=conv_shape), layer_name="norm_2")
         self.append(activation(), layer_name="act_2")
 
         if using_2d_pool:
@@ -263,18 +531,61 @@ class CNN_Block(sb.nnet.containers.Sequential):
                 layer_name="pooling",
             )
         else:
+            # Max-pooling over the frequency axis of [batch, time, freq, chan]
+            # inputs, which nn.MaxPool2d sees as (N, C, H, W) so that the
+            # pooling runs on the contiguous input without any transpose.
             self.append(
-                sb.nnet.pooling.Pooling1d(
-                    pool_type="max",
-                    input_dims=4,
-                    kernel_size=pooling_size,
-                    pool_axis=2,
+                torch.nn.MaxPool2d(
+                    kernel_size=(pooling_size, 1), stride=(pooling_size, 1)
                 ),
                 layer_name="pooling",
             )
 
+        # The pooling output is not needed for the backward pass, so the
+        # dropout can overwrite it instead of allocating a new tensor
         self.append(
-            sb.nnet.dropout.Dropout2d(drop_rate=dropout), layer_name="drop"
+            sb.nnet.dropout.Dropout2d(drop_rate=dropout, inplace=True),
+            layer_name="drop",
+        )
+
+        if channels_last:
+            # The memory format is preserved by .to(device) and when loading
+            # a checkpoint, so converting the weights once is enough.
+            self.conv_1.to(memory_format=torch.channels_last)
+            self.conv_2.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        """Applies the block, recomputing its activations in the backward
+        pass if ``checkpoint_activations`` is True.
+
+        Arguments
+        ---------
+        x : torch.Tensor
+            The input tensor, [batch, time, feats] or [batch, time, feats,
+            channels].
+
+        Returns
+        -------
+        x : torch.Tensor
+            Output of the block.
+        """
+        if (
+            self.checkpoint_activations
+            and self.training
+            and torch.is_grad_enabled()
+        ):
+            return self._checkpointed_forward(x)
+        for layer in self.values():
+            x = layer(x)
+        return x
+
+    @torch.jit.unused
+    def _checkpointed_forward(self, x):
+        """Applies the block without storing the intermediate activations"""
+        # The RNG state is restored for the recomputation, so that the
+        # dropout masks are the same as in the forward pass
+        return torch.utils.checkpoint.checkpoint(
+            super().forward, x, use_reentrant=False
         )
 
 
@@ -306,10 +617,14 @@ class DNN_Block(sb.nnet.containers.Sequential):
     ):
         super().__init__(input_shape=input_shape)
         self.append(
-            sb.nnet.linear.Linear,
-            n_neurons=neurons,
+            sb.nnet.linear.Linear(
+                input_shape=self.input_shape, n_neurons=neurons
+            ),
             layer_name="linear",
         )
-        self.append(sb.nnet.normalization.BatchNorm1d, layer_name="norm")
+        self.append(
+            sb.nnet.normalization.BatchNorm1d(input_size=neurons),
+            layer_name="norm",
+        )
         self.append(activation(), layer_name="act")
         self.append(torch.nn.Dropout(p=dropout), layer_name="dropout")
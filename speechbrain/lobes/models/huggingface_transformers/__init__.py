@@ -1,24 +1,65 @@
 """High level processing blocks.
 
 This subpackage gathers higher level blocks, or "lobes" for HuggingFace Transformers.
+
+The submodules and the classes below are imported lazily on first access, so
+that importing this package does not import `transformers` until an HF model is
+actually used.
 """
 
-# Transformers is required for this package.
-try:
-    import transformers  # noqa
-except ImportError:
-    MSG = "Please install transformers from HuggingFace.\n"
-    MSG += "E.G. run: pip install transformers \n"
-    MSG += "For more information, visit: https://huggingface.co/docs/transformers/installation"
-    raise ImportError(MSG)
-
-from .discrete_ssl import *  # noqa
-from .encodec import *  # noqa
-from .gpt import *  # noqa
-from .hubert import *  # noqa
-from .huggingface import *  # noqa
-from .textencoder import *  # noqa
-from .wav2vec2 import *  # noqa
-from .wavlm import *  # noqa
-from .weighted_ssl import *  # noqa
-from .whisper import *  # noqa
+import importlib
+
+from speechbrain.utils.importutils import lazy_export_all
+
+lazy_export_all(__file__, __name__)
+
+# re-exported names, mapped to the submodule defining them
+_LAZY = {
+    "DiscreteSSL": ".discrete_ssl",
+    "Encodec": ".encodec",
+    "GPT": ".gpt",
+    "HuBERT": ".hubert",
+    "HFTransformersInterface": ".huggingface",
+    "make_padding_masks": ".huggingface",
+    "TextEncoder": ".textencoder",
+    "Wav2Vec2": ".wav2vec2",
+    "Wav2Vec2Pretrain": ".wav2vec2",
+    "WavLM": ".wavlm",
+    "WeightedSSLModel": ".weighted_ssl",
+    "Whisper": ".whisper",
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    """Imports the submodule defining one of the re-exported names on first
+    access.
+
+    Arguments
+    ---------
+    name : str
+        Name of the attribute being looked up.
+
+    Returns
+    -------
+    object
+        The class or function of that name from its defining submodule.
+    """
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    mod = importlib.import_module(_LAZY[name], __name__)
+    # cached, so that later lookups do not go through __getattr__ again
+    globals()[name] = getattr(mod, name)
+    return globals()[name]
+
+
+def __dir__():
+    """Lists the re-exported names along with the module attributes.
+
+    Returns
+    -------
+    list of str
+        The sorted attribute names of this package.
+    """
+    return sorted(set(globals()) | set(_LAZY))
@@ -28,21 +28,31 @@ import pathlib
 import torch
 from huggingface_hub import model_info
 from torch import nn
-from transformers import (
-    AutoConfig,
-    AutoFeatureExtractor,
-    AutoModel,
-    AutoModelForCausalLM,
-    AutoModelForPreTraining,
-    AutoModelForSeq2SeqLM,
-    AutoModelWithLMHead,
-    AutoTokenizer,
-)
 
 from speechbrain.dataio.dataio import length_to_mask
 from speechbrain.utils.fetching import fetch
 from speechbrain.utils.logger import get_logger
 
+TRANSFORMERS_INSTALL_MSG = (
+    "Please install transformers from HuggingFace.\n"
+    "E.G. run: pip install transformers \n"
+    "For more information, visit: https://huggingface.co/docs/transformers/installation"
+)
+
+try:
+    from transformers import (
+        AutoConfig,
+        AutoFeatureExtractor,
+        AutoModel,
+        AutoModelForCausalLM,
+        AutoModelForPreTraining,
+        AutoModelForSeq2SeqLM,
+        AutoModelWithLMHead,
+        AutoTokenizer,
+    )
+except ImportError as e:
+    raise ImportError(TRANSFORMERS_INSTALL_MSG) from e
+
 logger = get_logger(__name__)
 
 
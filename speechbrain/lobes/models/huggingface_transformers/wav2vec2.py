@@ -15,15 +15,22 @@ Authors
 import numpy as np
 import torch
 import torch.nn.functional as F
-import transformers
-from transformers.models.wav2vec2.modeling_wav2vec2 import _compute_mask_indices
 
 from speechbrain.lobes.models.huggingface_transformers.huggingface import (
+    TRANSFORMERS_INSTALL_MSG,
     HFTransformersInterface,
     make_padding_masks,
 )
 from speechbrain.utils.logger import get_logger
 
+try:
+    import transformers
+    from transformers.models.wav2vec2.modeling_wav2vec2 import (
+        _compute_mask_indices,
+    )
+except ImportError as e:
+    raise ImportError(TRANSFORMERS_INSTALL_MSG) from e
+
 logger = get_logger(__name__)
 
 
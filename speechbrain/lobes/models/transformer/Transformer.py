@@ -5,7 +5,8 @@ Authors
 """
 
 import math
-from typing import Optional
+from dataclasses import dataclass
+from typing import List, Optional
 
 import torch
 import torch.nn as nn
@@ -20,6 +21,52 @@ from .Branchformer import BranchformerEncoder
 from .Conformer import ConformerEncoder
 
 
+@dataclass
+class TransformerDecoderLayerCache:
+    """Decoding state of a `TransformerDecoderLayer`, for step-by-step
+    autoregressive decoding."""
+
+    self_attn_inputs: Optional[torch.Tensor] = None
+    """Inputs of the self-attention (keys and values) for the positions
+    decoded so far, of shape (batch, time, d_model), or `None` before the
+    first step."""
+
+
+@dataclass
+class TransformerDecoderCache:
+    """Decoding state of a `TransformerDecoder`, for step-by-step
+    autoregressive decoding.
+
+    The previous positions are not recomputed at each step: only the new
+    positions go through the decoder layers, and attend to the cached
+    self-attention inputs of the previous ones.
+    """
+
+    layers: List[TransformerDecoderLayerCache]
+    """Decoding state of each layer of the decoder."""
+
+    @property
+    def past_len(self):
+        """Number of positions held in the cache."""
+        past = self.layers[0].self_attn_inputs if self.layers else None
+        return 0 if past is None else past.shape[1]
+
+    def reorder(self, index):
+        """Selects the batch entries of the cache, e.g. when the hypotheses of
+        a beam search are permuted.
+
+        Arguments
+        ---------
+        index : torch.Tensor
+            The indices of the batch entries to keep, in order.
+        """
+        for layer in self.layers:
+            if layer.self_attn_inputs is not None:
+                layer.self_attn_inputs = layer.self_attn_inputs.index_select(
+                    0, index
+                )
+
+
 class TransformerInterface(nn.Module):
     """This is an interface for transformer model.
     Users can modify the attributes and define the forward function as
@@ -237,6 +284,48 @@ class TransformerInterface(nn.Module):
         """Users should modify this function according to their own tasks."""
         raise NotImplementedError
 
+    def quantize_for_inference(self):
+        """Dynamically quantizes the encoder and decoder to INT8 for CPU
+        inference.
+
+        Every ``torch.nn.Linear`` of the encoder and decoder (mostly the
+        feed-forward layers) is replaced in place by a dynamically quantized
+        linear with per-channel int8 weight scales. The activations are
+        quantized on the fly, while normalization, softmax and the packed
+        attention projections stay in floating point. The quantized layers
+        run on CPU only and cannot be trained any further.
+
+        Raises
+        ------
+        ValueError
+            If the model is in training mode.
+
+        Example
+        -------
+        >>> from speechbrain.lobes.models.transformer.TransformerASR import (
+        ...     TransformerASR,
+        ... )
+        >>> model = TransformerASR(
+        ...     720, 512, 512, 8, 1, 1, 1024, causal=False
+        ... ).eval()
+        >>> model.quantize_for_inference()
+        >>> src = torch.rand([8, 120, 512])
+        >>> model.encode(src).shape
+        torch.Size([8, 120, 512])
+        """
+        if self.training:
+            raise ValueError("quantize_for_inference requires eval mode")
+
+        qconfig = torch.ao.quantization.per_channel_dynamic_qconfig
+        for name in ("encoder", "decoder"):
+            if hasattr(self, name):
+                torch.ao.quantization.quantize_dynamic(
+                    getattr(self, name),
+                    {nn.Linear: qconfig},
+                    dtype=torch.qint8,
+                    inplace=True,
+                )
+
 
 class PositionalEncoding(nn.Module):
     """This class implements the absolute sinusoidal positional encoding function.
@@ -287,9 +376,11 @@ class PositionalEncoding(nn.Module):
 
         Returns
         -------
-        The positional encoding.
+        The positional encoding, in the dtype of ``x``. When no cast is
+        needed, this is a view of the buffer, so it must not be modified
+        in-place.
         """
-        return self.pe[:, : x.size(1)].clone().detach()
+        return self.pe[:, : x.size(1)].to(dtype=x.dtype)
 
 
 class TransformerEncoderLayer(nn.Module):
@@ -413,6 +504,7 @@ class TransformerEncoderLayer(nn.Module):
         src_mask: Optional[torch.Tensor] = None,
         src_key_padding_mask: Optional[torch.Tensor] = None,
         pos_embs: Optional[torch.Tensor] = None,
+        need_weights: bool = False,
     ):
         """
         Arguments
@@ -425,11 +517,16 @@ class TransformerEncoderLayer(nn.Module):
             The mask for the src keys for each example in the batch.
         pos_embs: torch.Tensor, optional
             The positional embeddings tensor.
+        need_weights: bool
+            Whether to compute the self-attention weights (False by default,
+            so that the fused attention kernels can be used).
 
         Returns
         -------
         output : torch.Tensor
             The output of the transformer encoder layer.
+        self_attn : torch.Tensor
+            The self-attention weights, or `None` if `need_weights` is False.
         """
 
         if self.normalize_before:
@@ -437,14 +534,20 @@ class TransformerEncoderLayer(nn.Module):
         else:
             src1 = src
 
-        output, self_attn = self.self_att(
+        # Not computing the self-attention weights lets MultiheadAttention
+        # dispatch to the fused SDPA kernels
+        self_attn = None
+        output = self.self_att(
             src1,
             src1,
             src1,
             attn_mask=src_mask,
             key_padding_mask=src_key_padding_mask,
+            return_attn_weights=need_weights,
             pos_embs=pos_embs,
         )
+        if need_weights:
+            output, self_attn = output
 
         # add & norm
         src = src + self.dropout1(output)
@@ -505,6 +608,11 @@ class TransformerEncoder(nn.Module):
         conv kernel size of 2 1d-convs if ffn_type is 1dcnn
     output_hidden_states: bool, optional
         Whether the model should output the hidden states as a list of tensor.
+    layer_sharing: int, optional
+        Number of consecutive layers sharing the same weights. The default
+        (1) gives every layer its own weights. Larger values divide the number
+        of encoder parameters (and the weights read per forward) accordingly,
+        usually at some cost in accuracy.
 
     Example
     -------
@@ -514,6 +622,9 @@ class TransformerEncoder(nn.Module):
     >>> output, _ = net(x)
     >>> output.shape
     torch.Size([8, 60, 512])
+    >>> _, attn_list = net(x, need_weights=True)
+    >>> attn_list[0].shape
+    torch.Size([8, 60, 60])
 
     >>> import torch
     >>> x = torch.rand((8, 60, 512))
@@ -523,6 +634,12 @@ class TransformerEncoder(nn.Module):
     torch.Size([8, 60, 512])
     >>> len(hidden_list)
     2
+
+    >>> net = TransformerEncoder(4, 8, 512, d_model=512, layer_sharing=2)
+    >>> net.layers[0] is net.layers[1]
+    True
+    >>> len(set(net.layers))
+    2
     """
 
     def __init__(
@@ -543,27 +660,35 @@ class TransformerEncoder(nn.Module):
         ffn_type="regularFFN",
         ffn_cnn_kernel_size_list=[3, 3],
         output_hidden_states=False,
+        layer_sharing=1,
     ):
         super().__init__()
 
+        if layer_sharing < 1:
+            raise ValueError(
+                f"layer_sharing must be a positive integer, got {layer_sharing}"
+            )
+
+        unique_layers = [
+            TransformerEncoderLayer(
+                d_ffn=d_ffn,
+                nhead=nhead,
+                d_model=d_model,
+                kdim=kdim,
+                vdim=vdim,
+                dropout=dropout,
+                activation=activation,
+                normalize_before=normalize_before,
+                causal=causal,
+                attention_type=attention_type,
+                ffn_type=ffn_type,
+                ffn_cnn_kernel_size_list=ffn_cnn_kernel_size_list,
+            )
+            for i in range(math.ceil(num_layers / layer_sharing))
+        ]
+        # consecutive positions reuse the same layer (and thus its weights)
         self.layers = torch.nn.ModuleList(
-            [
-                TransformerEncoderLayer(
-                    d_ffn=d_ffn,
-                    nhead=nhead,
-                    d_model=d_model,
-                    kdim=kdim,
-                    vdim=vdim,
-                    dropout=dropout,
-                    activation=activation,
-                    normalize_before=normalize_before,
-                    causal=causal,
-                    attention_type=attention_type,
-                    ffn_type=ffn_type,
-                    ffn_cnn_kernel_size_list=ffn_cnn_kernel_size_list,
-                )
-                for i in range(num_layers)
-            ]
+            [unique_layers[i // layer_sharing] for i in range(num_layers)]
         )
         self.norm = sb.nnet.normalization.LayerNorm(d_model, eps=1e-6)
         self.layerdrop_prob = layerdrop_prob
@@ -576,6 +701,7 @@ class TransformerEncoder(nn.Module):
         src_key_padding_mask: Optional[torch.Tensor] = None,
         pos_embs: Optional[torch.Tensor] = None,
         dynchunktrain_config=None,
+        need_weights: bool = False,
     ):
         """
         Arguments
@@ -590,13 +716,19 @@ class TransformerEncoder(nn.Module):
             The positional embedding tensor
         dynchunktrain_config : config
             Not supported for this encoder.
+        need_weights : bool
+            Whether to compute the self-attention weights of each layer
+            (False by default, so that the fused attention kernels can be
+            used).
 
         Returns
         -------
         output : torch.Tensor
             The output of the transformer.
         attention_lst : list
-            The attention values.
+            The attention values of each layer. Unless `need_weights` is
+            True, its entries are `None`, which differs from earlier versions
+            that always returned the weights.
         hidden_state_lst : list, optional
             The output of the hidden layers of the encoder.
             Only works if output_hidden_states is set to true.
@@ -624,6 +756,7 @@ class TransformerEncoder(nn.Module):
                     src_mask=src_mask,
                     src_key_padding_mask=src_key_padding_mask,
                     pos_embs=pos_embs,
+                    need_weights=need_weights,
                 )
                 attention_lst.append(attention)
 
@@ -671,6 +804,9 @@ class TransformerDecoderLayer(nn.Module):
     >>> output, self_attn, multihead_attn = net(src, tgt)
     >>> output.shape
     torch.Size([8, 60, 512])
+    >>> _, self_attn, _ = net(src, tgt, need_self_attn_weights=True)
+    >>> self_attn.shape
+    torch.Size([8, 60, 60])
     """
 
     def __init__(
@@ -740,10 +876,13 @@ class TransformerDecoderLayer(nn.Module):
         memory_key_padding_mask=None,
         pos_embs_tgt=None,
         pos_embs_src=None,
+        cache: Optional[TransformerDecoderLayerCache] = None,
+        need_self_attn_weights: bool = False,
+        need_cross_attn_weights: bool = True,
     ):
         """
         Arguments
-        ----------
+        ---------
         tgt: torch.Tensor
             The sequence to the decoder layer (required).
         memory: torch.Tensor
@@ -760,21 +899,59 @@ class TransformerDecoderLayer(nn.Module):
             The positional embeddings for the target (optional).
         pos_embs_src: torch.Tensor
             The positional embeddings for the source (optional).
+        cache: TransformerDecoderLayerCache
+            Mutable decoding state, when decoding step by step (optional).
+            `tgt` then only holds the new positions, which attend to the
+            cached previous ones, and `tgt_mask` must be the rows of the
+            lookahead mask for the new positions.
+        need_self_attn_weights: bool
+            Whether to compute the self-attention weights. False by default,
+            so that the fused attention kernels can be used, in which case
+            `None` is returned instead of the weights.
+        need_cross_attn_weights: bool
+            Whether to compute the encoder-decoder attention weights. When
+            False, `None` is returned instead, and the fused attention
+            kernels can be used for the encoder-decoder attention as well.
+
+        Returns
+        -------
+        tgt : torch.Tensor
+            The output of the decoder layer.
+        self_attn : torch.Tensor
+            The self-attention weights, or `None` if
+            `need_self_attn_weights` is False (the default).
+        multihead_attention : torch.Tensor
+            The encoder-decoder attention weights, or `None` if
+            `need_cross_attn_weights` is False.
         """
         if self.normalize_before:
             tgt1 = self.norm1(tgt)
         else:
             tgt1 = tgt
 
-        # self-attention over the target sequence
-        tgt2, self_attn = self.self_attn(
+        self_attn_inputs = tgt1
+        if cache is not None:
+            if cache.self_attn_inputs is not None:
+                self_attn_inputs = torch.cat(
+                    [cache.self_attn_inputs, tgt1], dim=1
+                )
+            cache.self_attn_inputs = self_attn_inputs
+
+        # self-attention over the target sequence, by default without
+        # computing the weights, so that MultiheadAttention can use the fused
+        # SDPA kernels
+        self_attn = None
+        tgt2 = self.self_attn(
             query=tgt1,
-            key=tgt1,
-            value=tgt1,
+            key=self_attn_inputs,
+            value=self_attn_inputs,
             attn_mask=tgt_mask,
             key_padding_mask=tgt_key_padding_mask,
+            return_attn_weights=need_self_attn_weights,
             pos_embs=pos_embs_tgt,
         )
+        if need_self_attn_weights:
+            tgt2, self_attn = tgt2
 
         # add & norm
         tgt = tgt + self.dropout1(tgt2)
@@ -788,14 +965,20 @@ class TransformerDecoderLayer(nn.Module):
 
         # multi-head attention over the target sequence and encoder states
 
-        tgt2, multihead_attention = self.multihead_attn(
+        multihead_attention = None
+        output = self.multihead_attn(
             query=tgt1,
             key=memory,
             value=memory,
             attn_mask=memory_mask,
             key_padding_mask=memory_key_padding_mask,
+            return_attn_weights=need_cross_attn_weights,
             pos_embs=pos_embs_src,
         )
+        if need_cross_attn_weights:
+            tgt2, multihead_attention = output
+        else:
+            tgt2 = output
 
         # add & norm
         tgt = tgt + self.dropout2(tgt2)
@@ -859,6 +1042,20 @@ class TransformerDecoder(nn.Module):
     >>> output, _, _ = net(src, tgt)
     >>> output.shape
     torch.Size([8, 60, 512])
+
+    When decoding step by step, a cache avoids recomputing the previous
+    positions at each step:
+
+    >>> net = net.eval()
+    >>> mask = get_lookahead_mask(tgt)
+    >>> output, _, _ = net(tgt, src, tgt_mask=mask)
+    >>> cache = net.make_cache()
+    >>> steps = [
+    ...     net(tgt[:, t : t + 1], src, mask[t : t + 1, : t + 1], cache=cache)[0]
+    ...     for t in range(tgt.shape[1])
+    ... ]
+    >>> torch.allclose(torch.cat(steps, dim=1), output, atol=1e-5)
+    True
     """
 
     def __init__(
@@ -905,10 +1102,13 @@ class TransformerDecoder(nn.Module):
         memory_key_padding_mask=None,
         pos_embs_tgt=None,
         pos_embs_src=None,
+        cache: Optional[TransformerDecoderCache] = None,
+        need_self_attn_weights: bool = False,
+        need_cross_attn_weights: bool = True,
     ):
         """
         Arguments
-        ----------
+        ---------
         tgt : torch.Tensor
             The sequence to the decoder layer (required).
         memory : torch.Tensor
@@ -925,10 +1125,32 @@ class TransformerDecoder(nn.Module):
             The positional embeddings for the target (optional).
         pos_embs_src : torch.Tensor
             The positional embeddings for the source (optional).
+        cache : TransformerDecoderCache
+            Mutable decoding state as created by `make_cache`, when decoding
+            step by step (optional). See `TransformerDecoderLayer.forward`.
+        need_self_attn_weights : bool
+            Whether to compute the self-attention weights of each layer
+            (False by default, so that the fused attention kernels can be
+            used).
+        need_cross_attn_weights : bool
+            Whether to compute the encoder-decoder attention weights (True by
+            default). Callers that discard them should pass False.
+
+        Returns
+        -------
+        output : torch.Tensor
+            The output of the decoder.
+        self_attns : list
+            The self-attention weights of each layer. Unless
+            `need_self_attn_weights` is True, its entries are `None`, which
+            differs from earlier versions that always returned the weights.
+        multihead_attns : list
+            The encoder-decoder attention weights of each layer (None if
+            `need_cross_attn_weights` is False).
         """
         output = tgt
         self_attns, multihead_attns = [], []
-        for dec_layer in self.layers:
+        for i, dec_layer in enumerate(self.layers):
             output, self_attn, multihead_attn = dec_layer(
                 output,
                 memory,
@@ -938,6 +1160,9 @@ class TransformerDecoder(nn.Module):
                 memory_key_padding_mask=memory_key_padding_mask,
                 pos_embs_tgt=pos_embs_tgt,
                 pos_embs_src=pos_embs_src,
+                cache=cache.layers[i] if cache is not None else None,
+                need_self_attn_weights=need_self_attn_weights,
+                need_cross_attn_weights=need_cross_attn_weights,
             )
             self_attns.append(self_attn)
             multihead_attns.append(multihead_attn)
@@ -945,6 +1170,17 @@ class TransformerDecoder(nn.Module):
 
         return output, self_attns, multihead_attns
 
+    def make_cache(self):
+        """Creates a blank decoding state, for step-by-step decoding.
+
+        Returns
+        -------
+        TransformerDecoderCache
+        """
+        return TransformerDecoderCache(
+            layers=[TransformerDecoderLayerCache() for _ in self.layers]
+        )
+
 
 class NormalizedEmbedding(nn.Module):
     """This class implements the normalized embedding layer for the transformer.
@@ -1002,19 +1238,16 @@ def get_key_padding_mask(padded_input, pad_idx):
             [False, False,  True],
             [False, False,  True]])
     """
-    if len(padded_input.shape) == 4:
-        bz, time, ch1, ch2 = padded_input.shape
-        padded_input = padded_input.reshape(bz, time, ch1 * ch2)
-
-    key_padded_mask = padded_input.eq(pad_idx).to(padded_input.device)
+    key_padded_mask = padded_input.eq(pad_idx)
+    if key_padded_mask.ndim == 4:
+        key_padded_mask = key_padded_mask.flatten(start_dim=2)
 
     # if the input is more than 2d, mask the locations where they are silence
     # across all channels
-    if len(padded_input.shape) > 2:
-        key_padded_mask = key_padded_mask.float().prod(dim=-1).bool()
-        return key_padded_mask.detach()
+    if key_padded_mask.ndim > 2:
+        key_padded_mask = key_padded_mask.all(dim=-1)
 
-    return key_padded_mask.detach()
+    return key_padded_mask
 
 
 def get_lookahead_mask(padded_input):
@@ -1028,7 +1261,9 @@ def get_lookahead_mask(padded_input):
     Returns
     -------
     mask : torch.Tensor
-        Binary mask for masking future frames.
+        Binary mask for masking future frames. The mask is a view of a cached
+        mask shared between calls on the same device, so it must not be
+        modified in-place.
 
     Example
     -------
@@ -1038,17 +1273,35 @@ def get_lookahead_mask(padded_input):
             [0., 0., -inf],
             [0., 0., 0.]])
     """
-    seq_len = padded_input.shape[1]
-    mask = (
-        torch.triu(torch.ones((seq_len, seq_len), device=padded_input.device))
-        == 1
-    ).transpose(0, 1)
-    mask = (
-        mask.float()
-        .masked_fill(mask == 0, float("-inf"))
-        .masked_fill(mask == 1, float(0.0))
-    )
-    return mask.detach().to(padded_input.device)
+    return _lookahead_mask(padded_input.shape[1], padded_input.device)
+
+
+# one mask per device, at the largest length requested so far, up to
+# _LOOKAHEAD_MASK_MAX_LEN (16 MB in fp32), so that one long utterance does not
+# pin a large mask for the life of the process
+_LOOKAHEAD_MASKS = {}
+_LOOKAHEAD_MASK_MAX_LEN = 2048
+
+
+def _lookahead_mask(seq_len, device):
+    """Returns the float mask of ``get_lookahead_mask`` as a view of the
+    cached mask for this device, which is only rebuilt for longer lengths.
+    The view is not contiguous and is shared between callers, so it must not
+    be modified in-place. Masks longer than ``_LOOKAHEAD_MASK_MAX_LEN`` are
+    built for each call and not cached."""
+    mask = _LOOKAHEAD_MASKS.get(device)
+    if mask is None or mask.shape[0] < seq_len:
+        # Not an inference tensor even if first requested under
+        # inference_mode, as the cached mask is then reused for training
+        with torch.inference_mode(False):
+            mask = torch.triu(
+                torch.full((seq_len, seq_len), float("-inf"), device=device),
+                diagonal=1,
+            )
+        if seq_len > _LOOKAHEAD_MASK_MAX_LEN:
+            return mask
+        _LOOKAHEAD_MASKS[device] = mask
+    return mask[:seq_len, :seq_len]
 
 
 def get_mask_from_lengths(lengths, max_len=None):
@@ -145,7 +145,9 @@ def make_transformer_src_tgt_masks(
     # mask out audio beyond the length of audio for each batch
     if wav_len is not None:
         abs_len = torch.round(wav_len * src.shape[1])
-        src_key_padding_mask = ~length_to_mask(abs_len).bool()
+        src_key_padding_mask = ~length_to_mask(
+            abs_len, max_len=src.shape[1], dtype=torch.bool
+        )
 
     # mask out the source
     src_mask = make_transformer_src_mask(
@@ -409,6 +411,7 @@ class TransformerASR(TransformerInterface):
             memory_key_padding_mask=src_key_padding_mask,
             pos_embs_tgt=pos_embs_target,
             pos_embs_src=pos_embs_encoder,
+            need_cross_attn_weights=False,
         )
 
         if self.output_hidden_states:
@@ -417,7 +420,7 @@ class TransformerASR(TransformerInterface):
             return encoder_out, decoder_out
 
     @torch.no_grad()
-    def decode(self, tgt, encoder_out, enc_len=None):
+    def decode(self, tgt, encoder_out, enc_len=None, cache=None):
         """This method implements a decoding step for the transformer model.
 
         Arguments
@@ -428,15 +431,31 @@ class TransformerASR(TransformerInterface):
             Hidden output of the encoder.
         enc_len : torch.LongTensor
             The actual length of encoder states.
+        cache : TransformerDecoderCache, optional
+            Mutable decoding state, as created by `self.decoder.make_cache()`,
+            which should be passed across steps. Only the positions of `tgt`
+            that are not in the cache yet are then decoded. This is meant for
+            external step-by-step decoding loops: the searchers in
+            `speechbrain.decoders` do not pass a cache, as they reorder the
+            hypotheses between steps.
 
         Returns
         -------
-        prediction
+        prediction : torch.Tensor
+            The output of the decoder. With a cache, it only covers the
+            positions that were not in the cache yet.
+        attention : torch.Tensor
+            The encoder-decoder attention weights of the last layer. With a
+            cache, they also only cover the newly decoded positions, unlike
+            without a cache, where they cover all the positions of `tgt`.
         """
         tgt_mask = get_lookahead_mask(tgt)
+        past_len = cache.past_len if cache is not None else 0
         src_key_padding_mask = None
         if enc_len is not None:
-            src_key_padding_mask = (1 - length_to_mask(enc_len)).bool()
+            src_key_padding_mask = ~length_to_mask(
+                enc_len, max_len=encoder_out.shape[1], dtype=torch.bool
+            )
 
         tgt = self.custom_tgt_module(tgt)
         if self.attention_type == "RelPosMHAXL":
@@ -451,6 +470,11 @@ class TransformerASR(TransformerInterface):
             pos_embs_target = None
             pos_embs_encoder = None
 
+        # the positions in the cache were already decoded
+        if past_len > 0:
+            tgt = tgt[:, past_len:]
+            tgt_mask = tgt_mask[past_len:]
+
         prediction, self_attns, multihead_attns = self.decoder(
             tgt,
             encoder_out,
@@ -458,6 +482,7 @@ class TransformerASR(TransformerInterface):
             memory_key_padding_mask=src_key_padding_mask,
             pos_embs_tgt=pos_embs_target,
             pos_embs_src=pos_embs_encoder,
+            cache=cache,
         )
         return prediction, multihead_attns[-1]
 
@@ -587,34 +612,24 @@ class TransformerASR(TransformerInterface):
             bz, t, ch1, ch2 = src.shape
             src = src.reshape(bz, t, ch1 * ch2)
 
-        # HACK: our problem here is that the positional_encoding is computed
-        # against the size of our source tensor, but we only know how many left
-        # context frames we're injecting to the encoder within the encoder
-        # context.
-        # so this workaround does just that.
-        #
-        # i'm not sure how this would be best refactored, but an option would be
-        # to let the encoder get the pos embedding itself and have a way to
-        # cache it.
-        #
-        # additionally, positional encoding functions take in a whole source
-        # tensor just to get its attributes (size, device, type) but this is
-        # sort of silly for the embeddings that don't need one.
-        # so we craft a dummy empty (uninitialized) tensor to help...
+        # the positional encoding has to cover the left context frames that
+        # the encoder injects from its context, in addition to the new ones.
+        # only the length matters, so no tensor is built just to convey it.
         known_left_context = context.encoder_context.layers[0].mha_left_context
-        if known_left_context is None:
-            pos_encoding_dummy = src
-        else:
-            target_shape = list(src.shape)
-            target_shape[-2] += known_left_context.shape[-2]
-            pos_encoding_dummy = torch.empty(size=target_shape).to(src)
+        num_frames = src.shape[1]
+        pos_len = num_frames
+        if known_left_context is not None:
+            pos_len += known_left_context.shape[-2]
 
         src = self.custom_src_module(src)
         if self.attention_type == "RelPosMHAXL":
-            pos_embs_source = self.positional_encoding(pos_encoding_dummy)
+            pos_embs_source = self.positional_encoding.make_pe(seq_len=pos_len)
 
         elif self.positional_encoding_type == "fixed_abs_sine":
-            src = src + self.positional_encoding(pos_encoding_dummy)
+            # the new frames come last, after the left context. src is the
+            # fresh output of the input projection, so it is updated in place
+            pe = self.positional_encoding.pe[:, pos_len - num_frames : pos_len]
+            src = src.add_(pe.to(dtype=src.dtype))
             pos_embs_source = None
 
         encoder_out, _ = self.encoder.forward_streaming(
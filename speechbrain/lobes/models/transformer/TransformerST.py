@@ -317,6 +317,7 @@ class TransformerST(TransformerASR):
             tgt_mask=tgt_mask,
             tgt_key_padding_mask=tgt_key_padding_mask,
             memory_key_padding_mask=src_key_padding_mask,
+            need_cross_attn_weights=False,
         )
 
         return encoder_out, decoder_out
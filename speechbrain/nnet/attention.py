@@ -848,16 +848,25 @@ class MultiheadAttention(nn.Module):
             sequence length, S is the source sequence length.
             This is returned only if `return_attn_weights=True` (True by default).
         """
-        # give tensors of shape (time, batch, fea)
-        query = query.permute(1, 0, 2)
-        key = key.permute(1, 0, 2)
-        value = value.permute(1, 0, 2)
+        # give tensors of shape (time, batch, fea), keeping shared inputs as
+        # the same tensor so that nn.MultiheadAttention projects them with a
+        # single packed matmul (self-attention, or keys/values of cross-attention)
+        if key is value:
+            if query is key:
+                query = key = value = query.permute(1, 0, 2)
+            else:
+                query = query.permute(1, 0, 2)
+                key = value = key.permute(1, 0, 2)
+        else:
+            query = query.permute(1, 0, 2)
+            key = key.permute(1, 0, 2)
+            value = value.permute(1, 0, 2)
 
         # this will be legit because of https://github.com/pytorch/pytorch/blob/5288d05cfdda85c46c4df84617fa7f37c21b10b3/torch/nn/functional.py#L4946
         # we can inject relative learnable pos embeddings directly in MHA via the attn_mask
         if pos_embs is not None:
             if attn_mask is not None:
-                attn_mask += pos_embs
+                attn_mask = attn_mask + pos_embs
             else:
                 attn_mask = pos_embs
 
@@ -930,11 +939,6 @@ class PositionalwiseFeedForward(nn.Module):
 
     def forward(self, x):
         """Applies PositionalwiseFeedForward to the input tensor x."""
-        # give a tensor of shape (time, batch, fea)
-        x = x.permute(1, 0, 2)
-        x = self.ffn(x)
-
-        # reshape the output back to (batch, time, fea)
-        x = x.permute(1, 0, 2)
-
-        return x
+        # the layers are position-wise, so they are applied on the
+        # contiguous (batch, time, fea) input directly, no permute needed
+        return self.ffn(x)
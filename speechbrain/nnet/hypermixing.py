@@ -126,8 +126,8 @@ class HyperMixing(nn.Module):
             unchanged. If a BoolTensor is provided, the positions with the
             value of True will be ignored while the position with the value
             of False will be unchanged.
-        return_attn_weights: torch.Tensor, optional
-            NOTE: Currently has NO effect.
+        return_attn_weights: bool, optional
+            Whether to also return the (dummy) attention weights.
         pos_embs: torch.Tensor, optional
             NOTE: Currently has NO effect.
 
@@ -139,7 +139,8 @@ class HyperMixing(nn.Module):
         attn_output_weights : torch.Tensor
             (B, L, S) where B is the batch size, L is the target
             sequence length, S is the source sequence length.
-            NOTE: always returns all zeros.
+            NOTE: always returns all zeros. This is returned only if
+            `return_attn_weights=True` (True by default).
         """
 
         # NOTE: We are ignoring keys and values, because HyperMixing can only be used in the encoder atm (where it's all the same)
@@ -189,6 +190,9 @@ class HyperMixing(nn.Module):
         # apply layer norm on outputs of the TM-MLP
         out = self.layer_norm(out)
 
+        if not return_attn_weights:
+            return out
+
         dummy_att_weights = torch.zeros(
             (bsize, seq_len, seq_len), device=out.device
         )
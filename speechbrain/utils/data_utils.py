@@ -506,6 +506,15 @@ def batch_pad_right(tensors: list, mode="constant", value=0):
                 )
         max_shape.append(max([x.shape[dim] for x in tensors]))
 
+    if mode == "constant":
+        # Copy every tensor into a single preallocated batch, rather than
+        # padding each tensor separately and then stacking the copies.
+        batched = tensors[0].new_full((len(tensors), *max_shape), value)
+        for i, t in enumerate(tensors):
+            batched[(i, *(slice(0, size) for size in t.shape))] = t
+        valid = [t.shape[0] / max_shape[0] for t in tensors]
+        return batched, torch.tensor(valid)
+
     batched = []
     valid = []
     for t in tensors:
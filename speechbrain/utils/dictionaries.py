@@ -102,7 +102,8 @@ class SynonymDictionary:
             Whether `a` and `b` should be considered synonyms. Not transitive,
             see the main class documentation."""
 
-        return (a == b) or (b in self.word_map[a])
+        # `.get`, as indexing the `defaultdict` would insert unknown words
+        return (a == b) or (b in self.word_map.get(a, ()))
 
     def get_synonyms_for(self, word: str) -> set:
         """Returns the set of synonyms for a given word.
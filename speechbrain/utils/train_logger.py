@@ -368,8 +368,11 @@ class ProgressSampleLogger:
         **kwargs: dict
             the parameters to be saved with
         """
+        # The tensors stay on their device: copying them to the CPU here
+        # would synchronize with the GPU on every step. They are only moved
+        # when saved.
         self.progress_samples.update(
-            {key: detach(value) for key, value in kwargs.items()}
+            {key: detach(value, to_cpu=False) for key, value in kwargs.items()}
         )
 
     def get_batch_sample(self, value):
@@ -407,7 +410,7 @@ class ProgressSampleLogger:
             The epoch number
         """
         for key, data in self.progress_samples.items():
-            self.save_item(key, data, epoch)
+            self.save_item(key, detach(data), epoch)
 
     @main_process_only
     def save_item(self, key, data, epoch):
@@ -460,7 +463,7 @@ def plot_spectrogram(spectrogram, ap=None, fig_size=(16, 10), output_fig=False):
     return fig
 
 
-def detach(value):
+def detach(value, to_cpu=True):
     """Detaches the specified object from the graph, which can be a
     single tensor or a dictionary of tensors. Dictionaries of tensors are
     converted recursively
@@ -469,6 +472,8 @@ def detach(value):
     ---------
     value: torch.Tensor|dict
         a tensor or a dictionary of tensors
+    to_cpu: bool
+        whether to also move the tensors to the CPU
 
     Returns
     -------
@@ -476,9 +481,13 @@ def detach(value):
         a tensor of dictionary of tensors
     """
     if isinstance(value, torch.Tensor):
-        result = value.detach().cpu()
+        result = value.detach()
+        if to_cpu:
+            result = result.cpu()
     elif isinstance(value, dict):
-        result = {key: detach(item_value) for key, item_value in value.items()}
+        result = {
+            key: detach(item_value, to_cpu) for key, item_value in value.items()
+        }
     else:
         result = value
     return result
@@ -0,0 +1,29 @@
+import pytest
+import torch
+
+
+def test_crdnn_tune_memory_format(device):
+
+    from speechbrain.lobes.models.CRDNN import CRDNN
+
+    inputs = torch.rand([2, 15, 20], device=device)
+    model = CRDNN(input_shape=inputs.shape, rnn_layers=1, dnn_blocks=1).to(
+        device
+    )
+    model.train()
+
+    best = model.tune_memory_format(inputs, n_iter=1)
+    assert best in (torch.contiguous_format, torch.channels_last)
+    assert model.training
+    conv_weights = [p for p in model.CNN.parameters() if p.dim() == 4]
+    assert all(p.is_contiguous(memory_format=best) for p in conv_weights)
+
+    with pytest.raises(ValueError):
+        model.tune_memory_format(inputs, n_iter=0)
+
+    # A failure while timing restores the original layout and mode
+    model.CNN.to(memory_format=torch.contiguous_format)
+    with pytest.raises(RuntimeError):
+        model.tune_memory_format(inputs[..., :5], n_iter=1)
+    assert model.training
+    assert all(p.is_contiguous() for p in conv_weights)
@@ -92,6 +92,30 @@ def test_read_arpa():
             num_grams, ngrams, backoffs = read_arpa(f)
 
 
+def test_read_arpa_path(tmpdir):
+    from speechbrain.lm.arpa import read_arpa
+
+    arpa_file = tmpdir.join("bigram.arpa")
+    arpa_file.write(
+        "\\data\\\n"
+        "ngram 1=2\n"
+        "ngram 2=1\n"
+        "\n"
+        "\\1-grams:\n"
+        "-0.6931 a\n"
+        "-0.6931 b 0.\n"
+        "\n"
+        "\\2-grams:\n"
+        "-0.6931 b a\n"
+        "\n"
+        "\\end\\\n"
+    )
+    num_grams, ngrams, backoffs = read_arpa(str(arpa_file))
+    assert num_grams == {1: 2, 2: 1}
+    assert ngrams[2][("b",)]["a"] == -0.6931
+    assert backoffs[1] == {("b",): 0.0}
+
+
 def test_weird_arpa_formats():
     # We've decided to not be picky about ARPA format
     import io
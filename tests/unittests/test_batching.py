@@ -33,6 +33,18 @@ def test_batch_pad_right_to(device):
         )
 
 
+def test_batch_pad_right_values(device):
+    from speechbrain.utils.data_utils import batch_pad_right, pad_right_to
+
+    tensors = [torch.randn((length, 3), device=device) for length in [4, 7, 2]]
+    batched, lens = batch_pad_right(tensors, value=-1.0)
+    assert batched.shape == (3, 7, 3)
+    for tensor, padded in zip(tensors, batched):
+        expected, _ = pad_right_to(tensor, (7, 3), value=-1.0)
+        assert torch.equal(padded, expected)
+    assert torch.allclose(lens, torch.tensor([4 / 7, 1.0, 2 / 7]))
+
+
 def test_paddedbatch(device):
     from speechbrain.dataio.batch import PaddedBatch
 
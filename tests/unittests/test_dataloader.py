@@ -55,6 +55,74 @@ def test_saveable_dataloader_multiprocess(tmpdir):
         del new_dataloader
 
 
+def test_saveable_dataloader_recovery_position(tmpdir):
+    from speechbrain.dataio.dataloader import SaveableDataLoader
+
+    save_file = tmpdir + "/dataloader.ckpt"
+    dataset = torch.arange(10)
+    with open(save_file, "w") as fo:
+        fo.write("3")
+    for num_workers in [0, 2]:
+        dataloader = SaveableDataLoader(
+            dataset,
+            num_workers=num_workers,
+            persistent_workers=num_workers > 0,
+            collate_fn=None,
+        )
+        dataloader._speechbrain_load(save_file, end_of_epoch=False)
+        data_iterator = iter(dataloader)
+        assert next(data_iterator) == 3
+        # The saved position counts the skipped items too:
+        dataloader._speechbrain_save(tmpdir + "/resaved.ckpt")
+        with open(tmpdir + "/resaved.ckpt") as fi:
+            assert fi.read() == "4"
+        assert [int(x) for x in data_iterator] == list(range(4, 10))
+        # The next epoch starts from the beginning again:
+        assert [int(x) for x in dataloader] == list(range(10))
+        del data_iterator
+        del dataloader
+
+
+def test_plain_dataloader_unaffected():
+    # Recovery is handled within SaveableDataLoader, importing SpeechBrain
+    # must not change the behaviour of other DataLoaders
+    from torch.utils.data import DataLoader
+    from torch.utils.data.dataloader import _BaseDataLoaderIter
+
+    import speechbrain.dataio.dataloader  # noqa: F401
+
+    assert not hasattr(_BaseDataLoaderIter, "__old_init__")
+    dataloader = DataLoader(torch.arange(4), collate_fn=None)
+    dataloader._speechbrain_recovery_skip_to = 2
+    assert [int(x) for x in dataloader] == [0, 1, 2, 3]
+
+
+def test_make_dataloader_defaults():
+    from speechbrain.dataio.dataloader import make_dataloader
+
+    dataset = torch.arange(4)
+    dataloader = make_dataloader(dataset, num_workers=2)
+    assert dataloader.persistent_workers
+    assert dataloader.prefetch_factor == 4
+    assert dataloader.pin_memory == torch.cuda.is_available()
+
+    # Explicit kwargs take precedence over the defaults
+    dataloader = make_dataloader(
+        dataset,
+        num_workers=2,
+        persistent_workers=False,
+        prefetch_factor=2,
+        pin_memory=False,
+    )
+    assert not dataloader.persistent_workers
+    assert dataloader.prefetch_factor == 2
+    assert not dataloader.pin_memory
+
+    # Without workers, the worker options are left to PyTorch
+    dataloader = make_dataloader(dataset)
+    assert not dataloader.persistent_workers
+
+
 def test_looped_loader(tmpdir):
     # Tests that LoopedLoader will raise StopIteration appropriately
     # And that it can recover and keep the place.
@@ -24,3 +24,7 @@ def test_synonym_dictionary_json(tmpdir):
     assert not syn_dict("a", "b")
 
     assert not syn_dict("a2", "c")  # not transitive
+
+    # looking up unknown words does not add them to the dictionary
+    assert not syn_dict("unknown", "a")
+    assert "unknown" not in syn_dict.word_map
@@ -15,3 +15,31 @@ test_pretrained: !name:speechbrain.pretrained.interfaces.Pretrained
 """
     )
     assert yaml["test_pretrained"] is not None
+
+
+def test_lazy_huggingface_transformers_import():
+    """Test that importing the HuggingFace lobes does not import
+    `transformers`."""
+    import subprocess
+    import sys
+
+    code = (
+        "import sys\n"
+        "import speechbrain.lobes.models.huggingface_transformers\n"
+        "assert 'transformers' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_lazy_huggingface_transformers_names():
+    """Test that every lazily re-exported name of the HuggingFace lobes exists
+    in the submodule it is mapped to."""
+    import importlib
+
+    pytest.importorskip("transformers")
+    import speechbrain.lobes.models.huggingface_transformers as hf
+
+    for name, submodule in hf._LAZY.items():
+        module = importlib.import_module(submodule, hf.__name__)
+        assert hasattr(module, name), f"{name} not in {module.__name__}"
+        assert getattr(hf, name) is getattr(module, name)
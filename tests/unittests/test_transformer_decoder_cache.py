@@ -0,0 +1,48 @@
+import torch
+
+
+def test_transformer_asr_decode_cache(device):
+
+    from speechbrain.lobes.models.transformer.TransformerASR import (
+        TransformerASR,
+    )
+
+    torch.manual_seed(0)
+    model = TransformerASR(
+        tgt_vocab=20,
+        input_size=16,
+        d_model=32,
+        nhead=4,
+        num_encoder_layers=1,
+        num_decoder_layers=2,
+        d_ffn=64,
+    ).to(device)
+    model.eval()
+
+    src = torch.rand(3, 12, 16, device=device)
+    enc_len = torch.tensor([1.0, 0.8, 0.5], device=device)
+    encoder_out = model.encode(src, enc_len)
+    enc_len_abs = torch.round(enc_len * encoder_out.shape[1]).int()
+    tokens = torch.randint(1, 20, (3, 6), device=device)
+
+    cache = model.decoder.make_cache()
+    for step in range(1, tokens.shape[1] + 1):
+        tgt = tokens[:, :step]
+        full_pred, full_attn = model.decode(tgt, encoder_out, enc_len_abs)
+        pred, attn = model.decode(tgt, encoder_out, enc_len_abs, cache=cache)
+        assert cache.past_len == step
+        assert pred.shape[1] == 1
+        assert torch.allclose(pred[:, -1], full_pred[:, -1], atol=1e-5)
+        assert torch.allclose(attn[:, -1], full_attn[:, -1], atol=1e-5)
+
+    # reordering the cache, e.g. for beam search, reorders the hypotheses
+    index = torch.tensor([2, 0, 0], device=device)
+    cache.reorder(index)
+    tokens = torch.cat(
+        [tokens[index], torch.randint(1, 20, (3, 1), device=device)], dim=1
+    )
+    encoder_out = encoder_out[index]
+    enc_len_abs = enc_len_abs[index]
+    full_pred, _ = model.decode(tokens, encoder_out, enc_len_abs)
+    pred, _ = model.decode(tokens, encoder_out, enc_len_abs, cache=cache)
+    assert torch.allclose(pred[:, -1], full_pred[:, -1], atol=1e-5)
@@ -88,6 +88,27 @@ def test_get_lookahead_mask(device):
     assert torch.all(torch.eq(out, expected))
 
 
+def test_get_lookahead_mask_cache(device):
+
+    from speechbrain.lobes.models.transformer import Transformer
+
+    # A mask first requested under inference_mode is reusable for training
+    x = torch.zeros(2, 7, device=device)
+    with torch.inference_mode():
+        Transformer.get_lookahead_mask(x)
+    out = Transformer.get_lookahead_mask(x)
+    assert not out.is_inference()
+    assert torch.equal(out[:5, :5], Transformer.get_lookahead_mask(x[:, :5]))
+
+    # Longer masks than the cap are not cached
+    max_len = Transformer._LOOKAHEAD_MASK_MAX_LEN
+    x = torch.zeros(1, max_len + 1, device=device)
+    out = Transformer.get_lookahead_mask(x)
+    assert out.shape == (max_len + 1, max_len + 1)
+    cached = Transformer._LOOKAHEAD_MASKS[out.device]
+    assert cached.shape[0] <= max_len
+
+
 def test_get_key_padding_mask(device):
 
     from speechbrain.lobes.models.transformer.Transformer import (